@@ -1,12 +1,21 @@
 #!env python3
 
-from . import webdriver
-from . import tar
-from . import sqlite
-from . import toc
-from . import docset
-from . import downloader
+import importlib
 
+# submodules load on first use, so tools that only touch the index or the tar
+# do not pay for selenium, requests and bs4
+__all__ = [
+    "webdriver", "tar", "urls", "sqlite", "cache", "filters", "shard", "assets", "slim",
+    "toc", "docset", "progress", "profiler", "downloader", "delta", "sinks", "publish", "sitemap",
+]
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
 
 '''
 import logging
@@ -0,0 +1,78 @@
+#!env python3
+
+from fnmatch import fnmatchcase
+from typing import List, Tuple
+from pathlib import Path
+import logging
+import os
+import re
+
+CSS_BUNDLE = "bundle.css"
+JS_BUNDLE = "bundle.js"
+# scripts with no use offline: telemetry, consent banners and site chrome
+DROP_SCRIPTS = ["*analytics*", "*telemetry*", "*1ds*", "*wcp-consent*", "*consent*", "*feedback*"]
+
+CSS_TOKENS = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')|(/\*.*?\*/)|([^"\'/]+|/)', re.DOTALL)
+CSS_SPACE = re.compile(r"\s*([{};,])\s*")
+
+def minify_css(data: bytes) -> bytes:
+    # drops comments and whitespace outside of strings
+    out = list()
+    for string, comment, code in CSS_TOKENS.findall(data.decode('utf-8', 'replace')):
+        if string:
+            out.append(string)
+        elif code:
+            code = " ".join(code.split()) if code.strip() else " "
+            out.append(CSS_SPACE.sub(r"\1", code))
+    text = "".join(out).replace(";}", "}")
+    return text.strip().encode('utf-8')
+
+def bundle(files: List[Tuple[Path, bytes]], drop=(), separator=b"\n") -> Tuple[bytes, List[str], List[str]]:
+    '''
+    Concatenates theme files in the order they were found, skipping empty ones
+    and any basename matching a drop pattern.
+    returns: (bundle, bundled basenames, dropped basenames)
+    '''
+    parts, bundled, dropped = list(), list(), list()
+    for path, data in files:
+        name = os.path.basename(str(path))
+        if name in bundled or name in dropped:
+            continue
+        if not data.strip() or any(fnmatchcase(name.lower(), pattern) for pattern in drop):
+            dropped.append(name)
+            continue
+        parts.append(data)
+        bundled.append(name)
+    return separator.join(parts), bundled, dropped
+
+def theme_tag(kind, name):
+    if kind == "css":
+        return re.compile(rb'[ \t]*<link[^>]*href="/_themes_/' + re.escape(name.encode('utf-8')) + rb'"[^>]*>\n?')
+    return re.compile(rb'[ \t]*<script[^>]*src="/_themes_/' + re.escape(name.encode('utf-8')) + rb'"[^>]*>\s*</script>\n?')
+
+def link_bundle(contents: bytes, kind, bundled, dropped, bundle_name) -> bytes:
+    '''
+    Swaps page references to bundled theme files for one reference to the bundle,
+    placed where the first of them was. References to dropped files are removed.
+    '''
+    if kind == "css":
+        tag = f'<link href="/_themes_/{bundle_name}" rel="stylesheet"/>\n'.encode('utf-8')
+    else:
+        tag = f'<script src="/_themes_/{bundle_name}"></script>\n'.encode('utf-8')
+    first = None
+    for name in bundled:
+        for match in theme_tag(kind, name).finditer(contents):
+            if first is None or match.start() < first:
+                first = match.start()
+    for name in bundled + dropped:
+        contents = theme_tag(kind, name).sub(b"", contents)
+    if first is not None and tag.strip() not in contents:
+        contents = contents[:first] + tag + contents[first:]
+    return contents
+
+def is_bundle(href):
+    # pages read back after bundle_assets already link the bundles
+    return href in [f"/_themes_/{CSS_BUNDLE}", f"/_themes_/{JS_BUNDLE}"]
+
+def report(kind, before, after, bundled, dropped):
+    logging.info(f"Bundled {len(bundled)} {kind} files into {after} bytes from {before}, dropped {len(dropped)}: {', '.join(dropped)}")
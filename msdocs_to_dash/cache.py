@@ -0,0 +1,192 @@
+#!env python3
+
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+from pathlib import Path
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import zlib
+
+from msdocs_to_dash.urls import canonical_url
+
+EMPTY_TOC = b'{"items": []}'
+
+@dataclass
+class DirCache:
+    '''
+    Raw responses by url, kept beside a build so it can be redone offline.
+    <path>/index.json maps canonical url -> object name and (etag, last-modified),
+    bodies are stored as <path>/objects/<sha1[:2]>/<sha1>.
+    '''
+    path: str
+    _index: Dict[str, Tuple[str, Tuple[str, str]]] = field(default_factory=dict, init=False, repr=False)
+    # put is called from fetch worker threads
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    def __post_init__(self):
+        if self.exists():
+            with open(self.index_path(), 'r') as f:
+                self._index = {url: (name, tuple(validator)) for url, (name, validator) in json.load(f).items()}
+
+    def index_path(self):
+        return Path(self.path).joinpath("index.json")
+    def object_path(self, name):
+        return Path(self.path).joinpath("objects", name[:2], name)
+    def exists(self):
+        return self.index_path().exists()
+
+    def __contains__(self, url):
+        return canonical_url(url) in self._index
+    def __len__(self):
+        return len(self._index)
+
+    def get(self, url) -> Optional[bytes]:
+        entry = self._index.get(canonical_url(url))
+        if not entry:
+            return None
+        with open(self.object_path(entry[0]), 'rb') as f:
+            return f.read()
+
+    def validator(self, url) -> Tuple[str, str]:
+        entry = self._index.get(canonical_url(url))
+        return entry[1] if entry else ("", "")
+
+    def put(self, url, data, validator=("", "")):
+        name = hashlib.sha1(data).hexdigest()
+        path = self.object_path(name)
+        if not path.exists():
+            os.makedirs(path.parent, exist_ok=True)
+            # threads may store the same body at once, each swaps in a whole file
+            tmp_path = path.with_name(f"{name}.{threading.get_ident()}.tmp")
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        with self._lock:
+            self._index[canonical_url(url)] = (name, tuple(validator))
+
+    def flush(self):
+        os.makedirs(self.path, exist_ok=True)
+        tmp_path = self.index_path().with_name("index.json.tmp")
+        with self._lock, open(tmp_path, 'w') as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self.index_path())
+
+@dataclass
+class RecordingDriver:
+    '''
+    Passes requests to a WebDriver and keeps every response body in cache,
+    so the build can later be redone by OfflineDriver.
+    '''
+    driver: 'WebDriver'
+    cache: DirCache
+
+    @property
+    def latency(self):
+        return self.driver.latency
+
+    def get_binary(self, url, output=None) -> bytes:
+        data = self.driver.get_binary(url, output)
+        self.cache.put(url, data)
+        return data
+
+    def get_if_changed(self, url, validator=("", "")):
+        data, validator = self.driver.get_if_changed(url, validator)
+        if data is not None:
+            self.cache.put(url, data, validator)
+        return data, validator
+
+    def get_text(self, url, params=None) -> str:
+        text = self.driver.get_text(url, params)
+        self.cache.put(url, text.encode('utf-8'))
+        return text
+
+@dataclass
+class OfflineDriver:
+    '''
+    Answers requests from a DirCache only, never touching the network.
+    Anything not cached is listed in missing and answered with an empty body,
+    so one pass finds every missing url instead of stopping at the first.
+    '''
+    cache: DirCache
+    missing: List[str] = field(default_factory=list)
+
+    def __post_init__(self):
+        if not self.cache.exists():
+            raise RuntimeError("No cached responses for an offline build", self.cache.path)
+
+    def lookup(self, url, empty=b''):
+        data = self.cache.get(url)
+        if data is None:
+            logging.error("Not cached: %s", url)
+            self.missing.append(url)
+            return empty
+        return data
+
+    def get_binary(self, url, output=None) -> bytes:
+        if url.endswith("toc.json") or "/toc.json?" in url:
+            return self.lookup(url, EMPTY_TOC)
+        return self.lookup(url)
+
+    def get_if_changed(self, url, validator=("", "")):
+        cached = self.cache.validator(url)
+        if url in self.cache and any(validator) and validator == cached:
+            return None, validator
+        return self.lookup(url, b'<html><body></body></html>'), cached
+
+    def get_text(self, url, params=None) -> str:
+        return self.lookup(url).decode('utf-8')
+
+    def check(self):
+        # call once the crawl and themes are done
+        if self.missing:
+            raise RuntimeError(f"Offline build is missing {len(self.missing)} cached responses", sorted(set(self.missing)))
+
+@dataclass
+class PageStore:
+    '''
+    Pages as fetched, before rewrite, packed in one SQLite file instead of a
+    folder tree, usable as the input of a crawl. Each page is one row keyed by its local path,
+    zlib compressed at level compress, 0 stores pages as is.
+    '''
+    path: str
+    compress: int = 0
+    _db: sqlite3.Connection = field(default=None, init=False, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    def __post_init__(self):
+        os.makedirs(Path(self.path).parent, exist_ok=True)
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS pages(path TEXT PRIMARY KEY, compressed INTEGER, data BLOB)")
+
+    def __contains__(self, path):
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM pages WHERE path = ?", (str(path),)).fetchone() is not None
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+    def get(self, path) -> Optional[bytes]:
+        with self._lock:
+            row = self._db.execute("SELECT compressed, data FROM pages WHERE path = ?", (str(path),)).fetchone()
+        if not row:
+            return None
+        return zlib.decompress(row[1]) if row[0] else bytes(row[1])
+
+    def put(self, path, data):
+        compressed = self.compress > 0
+        if compressed:
+            data = zlib.compress(data, self.compress)
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?)", (str(path), int(compressed), data))
+
+    def commit(self):
+        with self._lock:
+            self._db.commit()
+
+    def close(self):
+        self.commit()
+        self._db.close()
@@ -0,0 +1,154 @@
+#!env python3
+
+from dataclasses import dataclass, field
+from typing import Dict, Tuple, Set
+from pathlib import Path
+from tarfile import TarFile
+import copy
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+from msdocs_to_dash.sqlite import SqLiteDb
+from msdocs_to_dash.tar import tar_write_bytes
+
+DATABASE = "Contents/Resources/docSet.dsidx"
+MANIFEST = "delta.json"
+FILES = "files/"
+
+@dataclass
+class Snapshot:
+    '''
+    Content hashes of a packaged docset: every archive member except the
+    index, plus the searchIndex rows and full text rows of the index.
+    '''
+    files: Dict[str, str] = field(default_factory=dict) # name -> sha256
+    rows: Set[Tuple[str, str, str]] = field(default_factory=set) # (name, type, path)
+    text: Dict[str, Tuple[str, str]] = field(default_factory=dict) # path -> (name, body)
+
+    @staticmethod
+    def from_tar(tar_path, workdir):
+        snap = Snapshot()
+        with TarFile.open(str(tar_path)) as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                data = tar.extractfile(member)
+                if member.name == DATABASE:
+                    db_path = Path(workdir).joinpath(os.path.basename(DATABASE))
+                    with open(db_path, 'wb') as f:
+                        shutil.copyfileobj(data, f)
+                    snap.read_database(db_path)
+                    continue
+                digest = hashlib.sha256()
+                for chunk in iter(lambda: data.read(1 << 16), b''):
+                    digest.update(chunk)
+                snap.files[member.name] = digest.hexdigest()
+        return snap
+
+    def read_database(self, db_path):
+        db = SqLiteDb.open(db_path)
+        db.cur.execute('SELECT name, type, path FROM searchIndex')
+        self.rows = set(db.cur.fetchall())
+        if db.fts:
+            db.cur.execute('SELECT path, name, body FROM searchText')
+            self.text = {path: (name, body) for path, name, body in db.cur.fetchall()}
+        db.db.close()
+
+    def checksum(self):
+        digest = hashlib.sha256()
+        for name in sorted(self.files):
+            digest.update(f"{name}\0{self.files[name]}\n".encode('utf-8'))
+        for row in sorted(self.rows):
+            digest.update(("\0".join(row) + "\n").encode('utf-8'))
+        for path in sorted(self.text):
+            digest.update(("\0".join((path,) + self.text[path]) + "\n").encode('utf-8'))
+        return digest.hexdigest()
+
+def make_delta(old_tar, new_tar, output) -> Path:
+    '''
+    Compares two packaged builds of a docset and writes <output> containing
+    delta.json with removed files and index row changes plus the added or
+    changed files under files/.
+    '''
+    with tempfile.TemporaryDirectory() as old_dir, tempfile.TemporaryDirectory() as new_dir:
+        old = Snapshot.from_tar(old_tar, old_dir)
+        new = Snapshot.from_tar(new_tar, new_dir)
+    changed = sorted(name for name, digest in new.files.items() if old.files.get(name) != digest)
+    manifest = {
+        "from": old.checksum(),
+        "to": new.checksum(),
+        "removed": sorted(set(old.files) - set(new.files)),
+        "changed": changed,
+        "rows_added": sorted(new.rows - old.rows),
+        "rows_removed": sorted(old.rows - new.rows),
+        "text_upsert": {path: new.text[path] for path in sorted(new.text) if old.text.get(path) != new.text[path]},
+        "text_removed": sorted(set(old.text) - set(new.text)),
+    }
+    output = Path(output)
+    tmp_path = output.with_name(f"{output.name}.tmp")
+    with TarFile.open(str(tmp_path), "w:gz") as delta, TarFile.open(str(new_tar)) as tar:
+        tar_write_bytes(delta, MANIFEST, json.dumps(manifest).encode('utf-8'))
+        wanted = set(changed)
+        for member in tar:
+            if member.name in wanted:
+                delta.addfile(renamed(member, f"{FILES}{member.name}"), tar.extractfile(member))
+    os.replace(tmp_path, output)
+    logging.info(f"Delta {output}: {len(changed)} changed, {len(manifest['removed'])} removed, "
+                 f"{len(manifest['rows_added'])}/{len(manifest['rows_removed'])} rows added/removed")
+    return output
+
+def apply_delta(old_tar, delta_tar, output) -> Path:
+    '''
+    Rebuilds the new package from the old one and a delta made by make_delta.
+    Raises RuntimeError if the old package does not match the delta or the
+    result does not match the checksum of the new build.
+    '''
+    output = Path(output)
+    tmp_path = output.with_name(f"{output.name}.tmp")
+    with tempfile.TemporaryDirectory() as workdir:
+        old = Snapshot.from_tar(old_tar, workdir)
+        with TarFile.open(str(delta_tar)) as delta:
+            manifest = json.load(delta.extractfile(MANIFEST))
+            if old.checksum() != manifest["from"]:
+                raise RuntimeError("Delta does not apply to this docset", old_tar)
+            db_path = Path(workdir).joinpath(os.path.basename(DATABASE))
+            apply_rows(db_path, manifest)
+            skip = set(manifest["removed"]) | set(manifest["changed"]) | {DATABASE}
+            with TarFile.open(str(tmp_path), "w:gz") as tar:
+                with TarFile.open(str(old_tar)) as old_pkg:
+                    for member in old_pkg:
+                        if member.name not in skip:
+                            tar.addfile(member, old_pkg.extractfile(member) if member.isfile() else None)
+                for member in delta:
+                    if member.name.startswith(FILES):
+                        tar.addfile(renamed(member, member.name[len(FILES):]), delta.extractfile(member))
+                tar.add(str(db_path), DATABASE)
+        new = Snapshot.from_tar(tmp_path, workdir)
+    if new.checksum() != manifest["to"]:
+        os.remove(tmp_path)
+        raise RuntimeError("Checksum mismatch after applying delta", delta_tar)
+    os.replace(tmp_path, output)
+    return output
+
+def renamed(member, name):
+    member = copy.copy(member)
+    member.name = name
+    return member
+
+def apply_rows(db_path, manifest):
+    db = SqLiteDb.open(db_path)
+    for name, rec_type, path in manifest["rows_removed"]:
+        db.cur.execute('DELETE FROM searchIndex WHERE name = ? AND type = ? AND path = ?', (name, rec_type, path))
+    for name, rec_type, path in manifest["rows_added"]:
+        # rows come from a built index, so they are inserted as is
+        db.cur.execute('INSERT OR IGNORE INTO searchIndex(name, type, path) VALUES (?,?,?)', (name, rec_type, path))
+    if db.fts:
+        for path in manifest["text_removed"] + list(manifest["text_upsert"]):
+            db.cur.execute('DELETE FROM searchText WHERE path = ?', (path,))
+        for path, (name, body) in manifest["text_upsert"].items():
+            db.cur.execute('INSERT INTO searchText(name, path, body) VALUES (?,?,?)', (name, path, body))
+    db.close()
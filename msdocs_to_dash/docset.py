@@ -1,17 +1,30 @@
 #!env python3
 
 from dataclasses import dataclass, field
-from typing import List, Union, Tuple
+from typing import List, Union, Tuple, Dict, Optional, Set
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import copy
 import logging
 import os
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlsplit
 from pathlib import Path
 from tarfile import TarFile, TarInfo
 import plistlib
 
-from msdocs_to_dash.tar import tar_write_str, tar_write_bytes
-from msdocs_to_dash.sqlite import SqLiteDb, Type
-from msdocs_to_dash.toc import Toc
+from msdocs_to_dash.tar import tar_write_bytes
+from msdocs_to_dash.sqlite import SqLiteDb, IndexWriter, Type
+from msdocs_to_dash.toc import Toc, Branch, Child, rewrite_page
+from msdocs_to_dash.urls import canonical_url, link_page, Visited
+from msdocs_to_dash.progress import Progress
+from msdocs_to_dash.filters import Selection, Match, node_path, rank
+from msdocs_to_dash.shard import Shard, shard_key, in_root_toc
+from msdocs_to_dash import assets
+from msdocs_to_dash.slim import Slimmer
+from msdocs_to_dash.publish import Publisher
+from msdocs_to_dash.sitemap import Sitemap
+
+PAGE_BYTES = 60 * 1024 # rough size of an unseen page for dry runs
+REWRITE_CHUNK = 16 # pages sent to a rewrite process at once
 
 @dataclass
 class DocCommon:
@@ -52,7 +65,7 @@ class DocCommon:
             for url in urls:
                 fname = os.path.basename(url)
                 path = Path(self.theme_path()).joinpath(fname)
-                data = webdriver.get_text(url)
+                data = webdriver.get_binary(url)
                 results.append((path, data))
             return results
         self._css_files = _get_(self._css_files, webdriver)
@@ -65,7 +78,7 @@ class DocCommon:
             # data -> (Path(local), css_data)
             if not isinstance(data, tuple):
                 raise RuntimeError("Did not gather theme files, not a tuple")
-            with open(self.theme_file_path(data[0], output), 'w') as f:
+            with open(self.theme_file_path(data[0], output), 'wb') as f:
                 f.write(data[1])
 
 @dataclass
@@ -77,17 +90,36 @@ class DocSource(DocCommon):
     language: str = "en-us"
     domain: str = "learn.microsoft.com"
     parent: 'DocSet' = None
+    prune: bool = True # reuse subtrees whose toc.json is unchanged since the previous crawl
+    progress: Optional[Progress] = field(default=None, repr=False)
+    selection: Optional[Selection] = None # only crawl and package matching subtrees
+    shard: Optional[Shard] = None # only crawl subtrees owned by this shard of a build
+    slim: Optional[Slimmer] = None # strip page weight during rewrite, defaults to the docset's
+    workers: int = 8 # concurrent page requests in the fetch phase
+    processes: int = 0 # rewrite pages on this many processes, 0 rewrites on the crawling thread
+    priority: List[str] = field(default_factory=list) # toc paths fetched first, in order, e.g. ["fileapi", "winreg"]
+    sitemap: Optional[Sitemap] = None # discover pages from a sitemap, only the root toc.json is read
     index: 'Toc' = field(default=None, init=False, repr=False)
     _tocs: List[Toc] = field(default_factory=list, init=False, repr=False)
+    # nodes of the previous crawl by url, reused when unchanged
+    _previous: Dict[str, Child] = field(default_factory=dict, init=False, repr=False)
+    _changes: int = field(default=0, init=False, repr=False)
+    _reused: int = field(default=0, init=False, repr=False)
+    _visited: Visited = field(default_factory=Visited, init=False, repr=False)
+    _own_visited: bool = field(default=True, init=False, repr=False)
+    _indexed: Set[int] = field(default_factory=set, init=False, repr=False) # nodes with an index row in the writer
+    _previous_tocs: Dict[str, Toc] = field(default_factory=dict, init=False, repr=False)
+    _crawled_selection: Tuple[Optional[Selection], Optional[Shard]] = field(default=(None, None), init=False, repr=False)
     # complete urls built on addition url -> (url, data)
-    _css_files: List[Union[str, Tuple[str,str]]] = field(default_factory=list, init=False, repr=False)
-    _js_files: List[Union[str, Tuple[str,str]]] = field(default_factory=list, init=False, repr=False)
+    _css_files: List[Union[str, Tuple[str,bytes]]] = field(default_factory=list, init=False, repr=False)
+    _js_files: List[Union[str, Tuple[str,bytes]]] = field(default_factory=list, init=False, repr=False)
 
     def __post_init__(self):
         # remove leading and trailing for appending
         for member in ["base_uri", "theme_uri", "toc_uri", "language", "domain"]:
             val = getattr(self, member).strip("/")
             setattr(self, member, val)
+        self.priority = [path.strip("/").lower() for path in self.priority]
         # append toc to base for full path
         if "toc.json" == self.toc_uri:
             self.toc_uri = f"{self.base_uri}/{self.toc_uri}"
@@ -109,55 +141,383 @@ class DocSource(DocCommon):
         url = url.lstrip("/")
         return f"https://{self.domain}/{url}"
     
-    def get_contents(self, webdriver, input):
-        todo_tocs = list() # (str, toc)
-        complete_tocs = set() # str
-        toc_json = webdriver.get_text(self.get_toc_url())
-        self.index = Toc.from_json(toc_json, self)
-        self.index.get_index(self.title, webdriver, input)
-        todo_tocs = self.index.get_contents(webdriver, input)
+    def get_contents(self, webdriver, input, visited=None):
+        # visited is shared by every source of a DocSet build, else one per crawl
+        self.discover(webdriver, input, visited)
+        self.fetch(webdriver, input)
+
+    def discover(self, webdriver, input, visited=None):
+        '''
+        First phase of a crawl: resolves every toc.json into the node tree
+        without fetching pages, only the index page is fetched for its title.
+        '''
+        if self.sitemap:
+            return self.discover_sitemap(webdriver, input, visited)
+        previous_tocs = self.start_crawl(visited)
+        self.discover_root(webdriver, input)
         self._tocs.append(self.index)
-        complete_tocs.add(self.get_toc_url())
+        todo_tocs = self.index.discover() # (toc_uri, parent)
+        if self.shard:
+            # the frontier below the root toc is split between shards, deeper tocs follow it
+            todo_tocs = [toc for toc in todo_tocs if self.shard.owns(shard_key(toc[0], self.base_uri))]
+        self.index.sub_tocs = list(todo_tocs)
         idx = 0
-        while idx < len(todo_tocs): # (toc_uri, parent)
+        while idx < len(todo_tocs):
             toc = todo_tocs[idx]
-            if not isinstance(toc, tuple):
-                idx += 1
+            idx += 1
+            self.set_queue(len(todo_tocs) - idx)
+            toc_url = self.get_toc_url(toc[0])
+            if not self.first_visit(toc_url, "toc"):
                 continue
-            toc_json = ""
-            if toc[0].strip("/") == self.index.base_uri():
-                idx += 1
+            toc_json = webdriver.get_binary(toc_url)
+            self.report("tocs", nbytes=len(toc_json), request=True)
+            prev_toc = previous_tocs.get(canonical_url(toc_url))
+            if self.prune and prev_toc and prev_toc.digest == Toc.digest_of(toc_json):
+                # unchanged toc.json, keep the whole previous subtree without descending
+                todo_tocs.extend(self.reuse_subtree(prev_toc, previous_tocs))
                 continue
-            toc_json = webdriver.get_text(self.get_toc_url(toc[0]))
             child_toc = Toc.from_json(toc_json, toc[1])
-            moar_tocs = child_toc.get_contents(webdriver, input)
-            complete_tocs.add(toc[0])
+            child_toc.path = toc_url
+            child_toc.sub_tocs = child_toc.discover()
             self._tocs.append(child_toc)
-            for mtoc in moar_tocs:
-                if mtoc[0] not in complete_tocs:
-                    todo_tocs.append(mtoc)
-            idx += 1
+            todo_tocs.extend(child_toc.sub_tocs)
+        self._previous_tocs = previous_tocs
 
-    def write_contents(self, output):
+    def discover_root(self, webdriver, input):
+        # parses the toc.json of the source itself and fetches the index page
+        root_url = self.get_toc_url()
+        self.first_visit(root_url, "toc")
+        toc_json = webdriver.get_binary(root_url)
+        self.report("tocs", nbytes=len(toc_json), request=True)
+        self.index = Toc.from_json(toc_json, self)
+        self.index.path = root_url
+        self.report("discovered") # the index page, pages below count once fetch knows them
+        self.index.get_index(self.title, webdriver, input)
+
+    def discover_sitemap(self, webdriver, input, visited=None):
+        '''
+        discover from the sitemap: the root toc.json gives titles and the top of
+        the hierarchy, every other page below base_uri comes from the sitemap in
+        bulk. Those pages hang below the root toc node of their folder, are
+        named after their heading once fetched, and keep their lastmod.
+        '''
+        self.start_crawl(visited)
+        self.discover_root(webdriver, input)
+        self._tocs.append(self.index)
+        # branch pages come from sub tocs, which are not read here
+        known = {canonical_url(node.url()): node for node in self.candidates()}
+        known[canonical_url(self.get_base_url())] = None
+        folders = dict()
+        for node in self.index.nodes():
+            if node.href and not node.isfile():
+                folders.setdefault(shard_key(node.folder()), node)
+        tocs = dict() # folder key -> Toc of sitemap pages
+        for url, lastmod in self.sitemap.pages(webdriver, self.get_base_url()):
+            if canonical_url(url) in known:
+                if known[canonical_url(url)]:
+                    known[canonical_url(url)].lastmod = lastmod
+                continue
+            known[canonical_url(url)] = None
+            href = urlsplit(url).path
+            if href.lower().startswith(f"/{self.language.lower()}/"):
+                href = href[len(self.language) + 1:]
+            key = shard_key(href, self.base_uri)
+            if self.shard and not self.shard.owns(key):
+                continue
+            if key not in tocs:
+                tocs[key] = Toc([], None, folders.get(key, self.index))
+                tocs[key].path = self.get_toc_url(f"{self.base_uri}/{key}")
+            node = Child(tocs[key], "", href)
+            node.lastmod = lastmod
+            if node.apply_selection():
+                tocs[key].items.append(node)
+        for key in sorted(tocs):
+            self._tocs.append(tocs[key])
+        self._previous_tocs = dict() # toc digests are not compared, lastmod covers changes
+
+    def localize(self, language):
+        '''
+        Points an already discovered source at another language. The node tree
+        and its local paths are kept, pages and themes are dropped so the next
+        fetch gets them in language.
+        '''
+        previous, language = f"/{self.language}/", language.strip("/")
+        self.language = language
+        self.theme_uri = f"/{self.theme_uri}/".replace(previous, f"/{language}/", 1).strip("/")
+        for toc in self._tocs:
+            toc.path = toc.path.replace(previous, f"/{language}/", 1)
+            toc.contents = b''
+            for node in toc.nodes():
+                node.reset()
+        self._previous, self._previous_tocs = dict(), dict()
+        self._css_files, self._js_files = list(), list()
+        self._changes, self._reused = 0, 0
+
+    def discover_titles(self, webdriver, input, visited=None):
+        '''
+        discover for a localized source: the known tocs are fetched once
+        each for their titles instead of walked, and the index page is fetched.
+        '''
+        self._own_visited = visited is None
+        self._visited = Visited() if visited is None else visited
+        self.first_visit(self.index.path, "toc")
+        self.index.get_index(self.title, webdriver, input)
+        for toc in self._tocs:
+            if toc is not self.index and not self.first_visit(toc.path, "toc"):
+                continue
+            toc_json = webdriver.get_binary(toc.path)
+            self.report("tocs", nbytes=len(toc_json), request=True)
+            try:
+                toc.localize(toc_json)
+            except ValueError:
+                logging.warning(f"No {self.language} toc at {toc.path}, keeping its titles")
+        self.report("discovered") # the index page
+
+    def manifest(self) -> List[Dict[str, str]]:
+        # every page the fetch phase will request, in crawl order and once per url
+        seen = set(self.visited().seen)
+        manifest = list()
+        for node in self.candidates():
+            key = canonical_url(node.url())
+            if key not in seen:
+                seen.add(key)
+                manifest.append({"url": node.url(), "path": str(node.file()), "type": str(node.dash_type()), "title": node.toc_title})
+        return manifest
+
+    def candidates(self):
+        # selected page nodes of this crawl, pages of reused tocs get revalidated
+        for toc in self._tocs:
+            for node in toc.nodes():
+                if not isinstance(node, Branch) and node.selected:
+                    yield node
+
+    def dry_run(self, page_bytes=PAGE_BYTES) -> Dict[str, int]:
+        '''
+        Counts of what fetch would do after discover. Pages seen by the previous
+        crawl count with their size, the others with page_bytes.
+        '''
+        pages = self.manifest()
+        known = [len(self.previous(page["url"]).contents) for page in pages if self.previous(page["url"])]
+        return {
+            "tocs": len(self._tocs),
+            "reused_tocs": self._reused,
+            "nodes": sum(1 for _ in self.nodes()),
+            "pages": len(pages),
+            "bytes": sum(known) + (len(pages) - len(known)) * page_bytes,
+        }
+
+    def fetch(self, webdriver, input):
+        '''
+        Second phase of a crawl: fetches every page found by discover.
+        Requests run on workers threads, reading and rewriting stay on this
+        thread in manifest order so the result does not depend on timing.
+        '''
+        candidates = list(self.candidates())
+        if self.priority:
+            candidates.sort(key=lambda node: rank(node, self.priority))
+        writer = self.index_writer()
+        publisher = self.get_publisher()
+        if writer:
+            # index rows only need the tree, the writer takes them while pages are fetched
+            self._indexed = set()
+            self.visit(lambda node: self.index_rows(writer, node, text=False))
+        # pages this fetch reaches, without duplicates, so the eta runs down to 0
+        self.report("discovered", len(self.manifest()))
+        pending = [node for node in candidates if node.prepare(input)]
+        with ThreadPoolExecutor(max_workers=max(self.workers, 1)) as pool:
+            results = pool.map(lambda node: node.request(webdriver), pending)
+            for idx, (node, result) in enumerate(zip(pending, results)):
+                self.set_queue(len(pending) - idx - 1)
+                node.finish(*result)
+                node.keep(input)
+                if publisher and publisher.tick():
+                    self.rewrite([node for node in candidates if node.stale])
+                    publisher.publish(self.parent, webdriver)
+        stale = [node for node in candidates if node.stale]
+        self.rewrite(stale)
+        if writer:
+            rewritten = set(id(node) for node in stale)
+            self.visit(lambda node: self.index_kept(writer, node, rewritten))
+        self.finish_crawl(self._previous_tocs)
+
+    def rewrite(self, nodes):
+        '''
+        Rewrites fetched pages, on a pool of processes when processes is set.
+        Workers only get the page bytes and a RewriteContext, results are
+        applied back to the nodes in order.
+        '''
+        writer = self.index_writer()
+        if self.processes < 2 or len(nodes) < 2:
+            for node in nodes:
+                node.rewrite()
+                if writer:
+                    self.index_rows(writer, node)
+            return
+        contexts = [node.rewrite_context() for node in nodes]
+        with ProcessPoolExecutor(max_workers=self.processes) as pool:
+            results = pool.map(rewrite_page, [node.contents for node in nodes], contexts, chunksize=REWRITE_CHUNK)
+            for node, result in zip(nodes, results):
+                node.rewrite(result)
+                if writer:
+                    self.index_rows(writer, node)
+
+    def index_kept(self, writer, node, rewritten):
+        # text of pages kept from the previous crawl, rewrite sent the others
+        if id(node) not in rewritten:
+            self.index_rows(writer, node)
+
+    def index_rows(self, writer, node, text=True):
+        '''
+        Sends the rows of node to writer, its index row only once and only
+        once it has a title: sitemap pages are named by rewrite.
+        '''
+        index = bool(node.toc_title) and id(node) not in self._indexed
+        if index:
+            self._indexed.add(id(node))
+        node.db_insert(writer, index=index, text=text)
+
+    def reuse_subtree(self, toc, previous_tocs):
+        '''
+        Adopts a toc from the previous crawl and every sub toc it led to.
+        returns: sub tocs missing from the previous crawl as [(toc, parent), ...]
+        so they still get crawled
+        '''
+        visited = self.visited()
+        missing = list()
+        stack = [toc]
+        while stack:
+            toc = stack.pop()
+            visited.mark(toc.path)
+            self._tocs.append(toc)
+            self._reused += 1
+            for sub_toc in toc.sub_tocs:
+                sub_url = self.get_toc_url(sub_toc[0])
+                if sub_url in visited:
+                    continue
+                if canonical_url(sub_url) in previous_tocs:
+                    stack.append(previous_tocs[canonical_url(sub_url)])
+                else:
+                    missing.append(sub_toc)
+        return missing
+
+    def start_crawl(self, visited=None):
+        # keep the previous crawl around so unchanged pages can be revalidated
+        # instead of downloaded, returns {toc path: toc} of the previous crawl
+        self._previous = dict()
+        for node in self.nodes():
+            if node.contents:
+                self._previous[node.url()] = node
+        previous_tocs = {canonical_url(toc.path): toc for toc in self._tocs}
+        if (self.selection, self.shard) != self._crawled_selection:
+            # tocs were parsed under other rules, so their subtrees cannot be reused
+            previous_tocs = dict()
+        self._crawled_selection = copy.deepcopy((self.selection, self.shard))
+        if self.index and self.index.page:
+            self._previous[self.index.page.url()] = self.index.page
+        self._tocs = list()
+        self._css_files = list()
+        self._js_files = list()
+        self._changes = 0
+        self._reused = 0
+        self._own_visited = visited is None
+        self._visited = Visited() if visited is None else visited
+        return previous_tocs
+
+    def finish_crawl(self, previous_tocs):
+        current = {canonical_url(toc.path): toc.digest for toc in self._tocs}
+        if previous_tocs and current != {path: toc.digest for path, toc in previous_tocs.items()}:
+            self.mark_changed()
+        if self._reused:
+            logging.info(f"Reused {self._reused} unchanged tocs for {self.title}")
+        if self._own_visited:
+            logging.info(f"Crawled {self.title}: {self._visited.report()}")
+        self._previous = dict()
+
+    def pages(self):
+        # every node holding a page, index first
+        if self.index and self.index.page:
+            yield self.index.page
+        for node in self.nodes():
+            if node.contents:
+                yield node
+
+    def visited(self):
+        return self._visited
+
+    def get_progress(self):
+        if self.progress:
+            return self.progress
+        if self.parent:
+            return self.parent.progress
+        return None
+    def report(self, event, count=1, nbytes=0, request=False):
+        progress = self.get_progress()
+        if progress:
+            progress.add(event, count, nbytes, request)
+    def slimmer(self):
+        if self.slim:
+            return self.slim
+        if self.parent:
+            return self.parent.slim
+        return None
+    def get_publisher(self):
+        if self.parent:
+            return self.parent.publisher
+        return None
+    def index_writer(self):
+        if self.parent:
+            return self.parent.writer
+        return None
+    def set_queue(self, depth):
+        progress = self.get_progress()
+        if progress:
+            progress.set_queue(depth)
+    def first_visit(self, url, kind="page") -> bool:
+        return self.visited().visit(url, kind)
+    def select(self, node) -> Match:
+        match = Match.Keep
+        if self.selection:
+            match = self.selection.match(node)
+        if match is Match.Keep and self.shard and in_root_toc(node) and \
+        not self.shard.owns(shard_key(node_path(node))):
+            # another shard fetches it, sub tocs are dropped from the frontier
+            return Match.Walk
+        return match
+
+    def previous(self, url):
+        return self._previous.get(url)
+    def mark_changed(self):
+        self._changes += 1
+    def changed(self) -> bool:
+        return self._changes > 0
+
+    def nodes(self):
+        for toc in self._tocs:
+            yield from toc.nodes()
+
+    def visit(self, *sinks):
+        # one pass over every crawled node, feeding each to all sinks
+        for toc in self._tocs:
+            toc.visit(*sinks)
+
+    def write_contents(self, output, *sinks):
         super().write_contents(output)
         self.index.write_index(self.documents_path(output))
-        for toc in self._tocs:
-            toc.write(self.documents_path(output))
+        documents = self.documents_path(output)
+        self.visit(lambda node: node.write(documents), *sinks)
     
-    def write_tar(self, tar):
+    def write_tar(self, tar, *sinks):
         self.index.write_index_tar(tar)
         for data in self._css_files + self._js_files:
-            tar_write_str(
+            tar_write_bytes(
                 tar,
                 self.theme_file_path(data[0]),
                 data[1]
             )
-        for toc in self._tocs:
-            toc.write_tar(tar)
+        self.visit(lambda node: node.write_tar(tar), *sinks)
         
     def make_database(self, db):
-        for toc in self._tocs:
-            toc.db_insert(db)
+        self.visit(lambda node: node.db_insert(db))
     # terminate
     def folder(self, dir):
         return dir
@@ -172,10 +532,19 @@ class DocSet(DocCommon):
     identifier: str = field(default="")    
     sources: List["DocSource"] = field(default_factory=list)
     ico_uri: str = "media/logos/logo-ms-social.png"
+    # add a searchText table of page text to docSet.dsidx, for SqLiteDb.search_text
+    # and other readers of the index, Dash and Zeal never read it
+    fts: bool = False
+    publisher: Optional[Publisher] = field(default=None, repr=False) # publish partial snapshots during the fetch
+    progress: Optional[Progress] = field(default=None, repr=False)
+    slim: Optional[Slimmer] = None # e.g. Slimmer(), Slimmer(rules=["json_ld", "data_bi"])
     # complete urls built on addition url -> (url, data)
-    _css_files: List[Union[str, Tuple[str,str]]] = field(default_factory=list, init=False, repr=False)
-    _js_files: List[Union[str, Tuple[str,str]]] = field(default_factory=list, init=False, repr=False)
+    _css_files: List[Union[str, Tuple[str,bytes]]] = field(default_factory=list, init=False, repr=False)
+    _js_files: List[Union[str, Tuple[str,bytes]]] = field(default_factory=list, init=False, repr=False)
     _ico: bytes = field(default=b'', init=False, repr=False)
+    _visited: Visited = field(default_factory=Visited, init=False, repr=False)
+    writer: Optional[IndexWriter] = field(default=None, init=False, repr=False) # set by start_index until fetch ends
+    _database: Optional[Path] = field(default=None, init=False, repr=False) # built by the last writer
 
     def __post_init__(self):
         if isinstance(self.sources, DocSource):
@@ -185,8 +554,99 @@ class DocSet(DocCommon):
                 source.parent = self
     
     def get_contents(self, webdriver, input):
+        if self.progress:
+            self.progress.start() # a new build
+        self.discover(webdriver, input)
+        self.fetch(webdriver, input)
+
+    def discover(self, webdriver, input):
+        self._visited = Visited()
+        for source in self.sources:
+            source.discover(webdriver, input, self._visited)
+
+    def localize(self, language) -> 'DocSet':
+        '''
+        Copy of a discovered docset for another language that shares its toc
+        structure, call discover_titles and fetch on the copy.
+        '''
+        docset = copy.deepcopy(self)
+        docset.title = f"{self.title} ({language})"
+        docset.identifier = f"{self.identifier}-{language}"
+        docset._database = None
+        for source in docset.sources:
+            source.localize(language)
+        return docset
+
+    def discover_titles(self, webdriver, input):
+        self._visited = Visited()
+        for source in self.sources:
+            source.discover_titles(webdriver, input, self._visited)
+
+    def dry_run(self) -> Dict[str, int]:
+        # totals of DocSource.dry_run over every source, call after discover
+        totals = dict()
+        for source in self.sources:
+            for key, value in source.dry_run().items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def start_index(self, output, **options) -> IndexWriter:
+        '''
+        Builds docSet.dsidx below output on a writer thread during the next
+        fetch instead of in a pass afterwards, sinks then package that one.
+        options go to IndexWriter.
+        '''
+        db_path = self.database_path(output)
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._database = None
+        self.writer = IndexWriter(db_path, self.fts, **options)
+        return self.writer
+
+    def database(self) -> Optional[Path]:
+        # docSet.dsidx built during the last fetch, None without start_index
+        return self._database
+
+    def fetch(self, webdriver, input):
+        for source in self.sources:
+            source.fetch(webdriver, input)
+        if self.publisher:
+            self.publisher.publish(self, webdriver)
+            self.publisher.close()
+        if self.writer:
+            self.writer.close()
+            logging.info(f"Indexed {self.writer.rows} rows in {self.writer.commits} commits during the fetch")
+            self._database, self.writer = Path(self.writer.path), None
+        logging.info(f"Crawled {self.title}: {self._visited.report()}")
+        self.link_pages()
+        for slimmer in self.slimmers():
+            logging.info(slimmer.report())
+
+    def slimmers(self):
+        found = list()
+        for slimmer in [self.slim] + [source.slim for source in self.sources]:
+            if slimmer and all(slimmer is not other for other in found):
+                found.append(slimmer)
+        return found
+
+    def link_pages(self):
+        '''
+        Builds canonical url -> local file for every crawled page of every
+        source, then points absolute links found during rewrite at local files.
+        '''
+        index = dict()
+        for source in self.sources:
+            for node in source.pages():
+                index.setdefault(canonical_url(node.url()), str(node.file()))
         for source in self.sources:
-            source.get_contents(webdriver, input)
+            for node in source.pages():
+                if node.links:
+                    node.contents = link_page(node.contents, str(node.file()), index)
+            if source.index and source.index.page:
+                source.index.contents = source.index.page.contents
+
+    def changed(self) -> bool:
+        # whether the last get_contents found new pages or toc changes
+        return any(source.changed() for source in self.sources)
     
     def write_contents(self, output):
         # writes to local files
@@ -195,9 +655,11 @@ class DocSet(DocCommon):
             f.write(self._ico)
         with open(self.plist_path(output), 'wb') as f:
             f.write(self.make_plist())
+        # files and index rows are written in the same pass over each source
+        db = self.new_database(output)
         for source in self.sources:
-            source.write_contents(output)
-        self.make_database(output)
+            source.write_contents(output, lambda node: node.db_insert(db))
+        db.close()
         
     def make_plist(self, index_path="") -> str:
         index_path = Path(index_path).joinpath("index.html")
@@ -215,21 +677,49 @@ class DocSet(DocCommon):
         }
         return plistlib.dumps(data)
     
-    def make_database(self, output):
+    def new_database(self, output):
         db_path = self.database_path(output)
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
-        db = SqLiteDb.new(db_path)
+        return SqLiteDb.new(db_path, self.fts)
+
+    def make_database(self, output):
+        db = self.new_database(output)
         for source in self.sources:
             source.make_database(db)
         db.close()
 
+    def theme_files(self) -> List[Tuple[str, bytes]]:
+        # (url or path, data) of every theme file, call after get_themes
+        files = self._css_files + self._js_files
+        for source in self.sources:
+            files = files + source._css_files + source._js_files
+        if any(not isinstance(data, tuple) for data in files):
+            raise RuntimeError("Did not gather theme files, not a tuple")
+        return files
+
+    def emit(self, *sinks) -> List[Path]:
+        '''
+        Writes every output of a build, see sinks.SINKS, in one pass over the
+        crawled pages without fetching or rewriting anything again.
+        returns: path written by each sink
+        '''
+        for sink in sinks:
+            sink.open(self)
+        for source in self.sources:
+            for sink in sinks:
+                sink.index(source)
+            source.visit(*[sink.add for sink in sinks])
+        return [sink.close(self) for sink in sinks]
+
     def make_package(self, output):
         tar_path = Path(output).joinpath(f"{self.title}.docset.tar")
-        with TarFile.open(str(tar_path), "w:gz") as tar:
+        # build beside the published archive and swap it in once complete
+        tmp_path = tar_path.with_name(f"{tar_path.name}.tmp")
+        with TarFile.open(str(tmp_path), "w:gz") as tar:
             tar_write_bytes(tar, self.ico_path(), self._ico)
             tar_write_bytes(tar, self.plist_path(), self.make_plist())
             for data in self._css_files + self._js_files:
-                tar_write_str(
+                tar_write_bytes(
                     tar,
                     self.theme_file_path(data[0], output),
                     data[1]
@@ -238,13 +728,45 @@ class DocSet(DocCommon):
                 source.write_tar(tar)
             tar.add(self.database_path(output), self.database_path())
             # add toc
+        os.replace(tmp_path, tar_path)
 
     def get_themes(self, webdriver):
         self._ico = self.get_ico(webdriver)
         super().get_themes(webdriver)
+        for slimmer in self.slimmers():
+            # style blocks hoisted out of pages during rewrite
+            self._css_files.extend(slimmer.files(self.theme_path()))
         for source in self.sources:
             source.get_themes(webdriver)
     
+    def bundle_assets(self, drop=assets.DROP_SCRIPTS):
+        '''
+        Call after get_themes, replaces the theme files of every source with one
+        minified css bundle and one js bundle and points pages at them.
+        js is only concatenated, minifying it safely needs a real parser.
+        '''
+        css_files, js_files = list(self._css_files), list(self._js_files)
+        for source in self.sources:
+            css_files.extend(source._css_files)
+            js_files.extend(source._js_files)
+        if any(not isinstance(data, tuple) for data in css_files + js_files):
+            raise RuntimeError("Did not gather theme files, not a tuple")
+        css, css_names, css_dropped = assets.bundle(css_files)
+        js, js_names, js_dropped = assets.bundle(js_files, drop, b"\n;\n")
+        before = sum(len(data) for _, data in css_files)
+        css = assets.minify_css(css)
+        assets.report("css", before, len(css), css_names, css_dropped)
+        assets.report("js", sum(len(data) for _, data in js_files), len(js), js_names, js_dropped)
+        self._css_files = [(self.theme_file_path(assets.CSS_BUNDLE), css)] if css_names else list()
+        self._js_files = [(self.theme_file_path(assets.JS_BUNDLE), js)] if js_names else list()
+        for source in self.sources:
+            source._css_files, source._js_files = list(), list()
+            for node in source.pages():
+                node.contents = assets.link_bundle(node.contents, "css", css_names, css_dropped, assets.CSS_BUNDLE)
+                node.contents = assets.link_bundle(node.contents, "js", js_names, js_dropped, assets.JS_BUNDLE)
+            if source.index and source.index.page:
+                source.index.contents = source.index.page.contents
+
     def get_ico_url(self, domain="", uri=""):
         if not domain:
             domain = self.sources[0].domain
@@ -1,12 +1,21 @@
 #!env python3
 
 from dataclasses import dataclass, field
-from typing import List
+from typing import List, Dict, Optional
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 import logging
+from pathlib import Path
+import threading
+import time
 
 from .webdriver import *
 from .toc import *
 from .docset import *
+from .profiler import Profiler
+from .progress import Progress
+from .cache import DirCache, RecordingDriver, OfflineDriver, PageStore
+from .sinks import SINKS
 
 DOC_SETS = [
     DocSet("Powershell",
@@ -17,22 +26,208 @@ DOC_SETS = [
     DocSet("Windows Desktop Api", "Win32k", DocSource("Win32k", "windows/win32/api")),
     DocSet("Windows Driver Framework", "WDF", DocSource("WDF", "windows-hardware/drivers/wdf")),
     DocSet("Kernel Mode Development", "KMD", DocSource("KMD", "windows-hardware/drivers/kernel")),
+    DocSet("Win32 File and Registry Api", "Win32kFs",
+        DocSource("Win32kFs", "windows/win32/api", selection=Selection(include=["fileapi", "winreg"]))),
 ]
 
 @dataclass
 class MsDownloader:
     source: 'DocSet'
     output: str = "./docs"
+    profile: bool = False # write per stage pstats and a slowest pages report
+    progress: Optional['Progress'] = None # live crawl status, Progress(machine=True) for json lines
+    bundle: bool = False # merge theme css and js into minified bundles
+    record: bool = False # keep raw responses in <output>/_cache_ for offline rebuilds
+    offline: bool = False # rebuild only from <output>/_cache_, without any request
+    formats: List[str] = field(default_factory=lambda: ["dash"]) # outputs written from one crawl, see sinks.SINKS
+    live_index: bool = True # write docSet.dsidx on its own thread while pages are fetched
+    packed: Optional[int] = None # keep pages in <output>/_pages_.db at this zlib level, 0 uncompressed, instead of a folder tree
     webdriver: 'WebDriver' = field(init=False, repr=False)
+    cache: 'DirCache' = field(default=None, init=False, repr=False)
+    pages: 'PageStore' = field(default=None, init=False, repr=False)
+    profiler: 'Profiler' = field(default=None, init=False, repr=False)
 
 
     def __post_init__(self):
         logging.info(f"Created downloader for {self.source.title}")
-        self.webdriver = WebDriver()
+        unknown = set(self.formats) - set(SINKS)
+        if unknown:
+            raise ValueError("Unknown output formats", unknown)
+        if self.offline or self.record:
+            self.cache = DirCache(Path(self.output).joinpath("_cache_"))
+        if self.offline:
+            self.webdriver = OfflineDriver(self.cache) # raises now if nothing was recorded
+        elif self.record:
+            self.webdriver = RecordingDriver(WebDriver(), self.cache)
+        else:
+            self.webdriver = WebDriver()
+        if self.packed is not None:
+            self.pages = PageStore(Path(self.output).joinpath("_pages_.db"), self.packed)
+        if self.profile:
+            self.profiler = Profiler(self.output)
+        if self.progress:
+            self.source.progress = self.progress
+
+    @contextmanager
+    def stage(self, name):
+        if not self.profiler:
+            yield
+            return
+        with self.profiler.stage(name):
+            yield
+
+    def start_progress(self):
+        # once per build, locales fetched at once share the status line
+        if self.progress:
+            self.progress.start()
+
+    def input(self):
+        # offline builds rewrite the raw cached pages, not the already rewritten output
+        if self.offline:
+            return None
+        return self.output if self.pages is None else self.pages
+
+    def fetched(self):
+        # after the network stages, fail before writing anything when offline files are missing
+        if self.offline:
+            self.webdriver.check()
+        elif self.cache:
+            self.cache.flush()
+        if self.pages is not None:
+            self.pages.commit() # pages were packed as they were fetched
+        if not self.offline:
+            logging.info("Request latency\n" + self.webdriver.latency.report())
     
+    def start_index(self, docset, output):
+        if self.live_index:
+            docset.start_index(output)
+
+    def emit(self, docset, output):
+        # every requested format in one pass over the crawled pages
+        for path in docset.emit(*[SINKS[name](output) for name in self.formats]):
+            logging.info(f"Wrote {path}")
+
+    def dry_run(self) -> Dict[str, int]:
+        # discovers every toc without fetching pages and reports what a build would fetch
+        self.start_progress()
+        with self.stage("discover"):
+            self.source.discover(self.webdriver, self.input())
+        report = self.source.dry_run()
+        logging.info(f"Dry run of {self.source.title}: " + ", ".join(f"{key} {value}" for key, value in report.items()))
+        return report
+
     def build_dash(self):
         logging.info(f"Building dash docset for {self.source.title}")
-        self.source.get_contents(self.webdriver, self.output)
-        self.source.get_themes(self.webdriver)
-        self.source.make_database(self.output)
-        self.source.make_package(self.output)
\ No newline at end of file
+        self.start_progress()
+        with self.stage("discover"):
+            self.source.discover(self.webdriver, self.input())
+        with self.stage("fetch"):
+            self.start_index(self.source, self.output)
+            self.source.fetch(self.webdriver, self.input())
+        with self.stage("get_themes"):
+            self.source.get_themes(self.webdriver)
+        self.fetched()
+        if self.bundle:
+            with self.stage("bundle_assets"):
+                self.source.bundle_assets()
+        with self.stage("emit"):
+            self.emit(self.source, self.output)
+        if self.progress:
+            self.progress.finish()
+        if self.profiler:
+            logging.info(self.profiler.write_report(self.source))
+
+    def build_locales(self, languages) -> Dict[str, Path]:
+        '''
+        Builds one package per language into <output>/<language>/ from a single
+        discover. Locales are fetched concurrently, each only requests its
+        localized toc titles and pages.
+        returns: language -> output folder
+        '''
+        logging.info(f"Building {', '.join(languages)} dash docsets for {self.source.title}")
+        self.start_progress()
+        with self.stage("discover"):
+            self.source.discover(self.webdriver, self.input())
+        outputs = {language: Path(self.output).joinpath(language) for language in languages}
+        def fetch(language):
+            docset = self.source.localize(language)
+            input = None if self.offline else outputs[language]
+            docset.discover_titles(self.webdriver, input)
+            self.start_index(docset, outputs[language])
+            docset.fetch(self.webdriver, input)
+            docset.get_themes(self.webdriver)
+            return docset
+        def package(docset, output):
+            if self.bundle:
+                docset.bundle_assets()
+            self.emit(docset, output)
+        with ThreadPoolExecutor(max_workers=max(len(languages), 1)) as pool:
+            with self.stage("fetch_locales"):
+                docsets = list(pool.map(fetch, languages))
+            self.fetched()
+            with self.stage("package_locales"):
+                list(pool.map(package, docsets, outputs.values()))
+        if self.progress:
+            self.progress.finish()
+        return outputs
+
+    def refresh(self) -> bool:
+        '''
+        Recrawl keeping the previous trees warm, unchanged pages are revalidated
+        instead of downloaded. Republishes the package only if something changed.
+        '''
+        logging.info(f"Refreshing dash docset for {self.source.title}")
+        with self.stage("get_contents"):
+            self.start_index(self.source, self.output)
+            self.source.get_contents(self.webdriver, self.input())
+        if not self.source.changed():
+            logging.info(f"No changes for {self.source.title}")
+            return False
+        with self.stage("get_themes"):
+            self.source.get_themes(self.webdriver)
+        self.fetched()
+        if self.bundle:
+            with self.stage("bundle_assets"):
+                self.source.bundle_assets()
+        with self.stage("emit"):
+            self.emit(self.source, self.output)
+        if self.progress:
+            self.progress.finish()
+        return True
+
+@dataclass
+class MsWatcher:
+    '''
+    Keeps downloaders alive and refreshes each on its own schedule.
+    schedules maps a docset title to its refresh interval in seconds,
+    anything not listed uses interval.
+    '''
+    downloaders: List['MsDownloader']
+    interval: float = 6 * 60 * 60
+    schedules: Dict[str, float] = field(default_factory=dict)
+    _stop: threading.Event = field(default_factory=threading.Event, init=False, repr=False)
+
+    def interval_for(self, downloader):
+        return self.schedules.get(downloader.source.title, self.interval)
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self, cycles=None):
+        # first cycle of each downloader is a full build, cycles limits total refreshes
+        due = [(0.0, idx) for idx in range(len(self.downloaders))]
+        start = time.monotonic()
+        done = 0
+        while not self._stop.is_set() and (cycles is None or done < cycles):
+            due.sort()
+            when, idx = due[0]
+            wait = when - (time.monotonic() - start)
+            if wait > 0 and self._stop.wait(wait):
+                break
+            downloader = self.downloaders[idx]
+            try:
+                downloader.refresh()
+            except Exception:
+                logging.exception(f"Refresh of {downloader.source.title} failed")
+            done += 1
+            due[0] = (time.monotonic() - start + self.interval_for(downloader), idx)
\ No newline at end of file
@@ -0,0 +1,108 @@
+#!env python3
+
+from dataclasses import dataclass, field
+from enum import Enum, auto
+from fnmatch import fnmatchcase
+from typing import List, Optional
+import regex
+
+class Match(Enum):
+    Skip = auto() # excluded, dropped from the toc with everything below it
+    Walk = auto() # not selected yet, sub tocs are crawled but its page is not fetched
+    Keep = auto() # selected, fetched along with everything below it
+
+@dataclass
+class Selection:
+    '''
+    Include and exclude rules applied while tocs are parsed, so excluded
+    subtrees are never fetched.
+    paths are toc paths below base_uri and select the whole subtree:
+    "fileapi" matches fileapi/ and fileapi/nf-fileapi-createfilew
+    urls are globs over the full page url, titles are regexes searched in toc_title.
+    With no include rules every node is selected unless excluded.
+    '''
+    include: List[str] = field(default_factory=list)
+    exclude: List[str] = field(default_factory=list)
+    include_urls: List[str] = field(default_factory=list)
+    exclude_urls: List[str] = field(default_factory=list)
+    include_titles: List[str] = field(default_factory=list)
+    exclude_titles: List[str] = field(default_factory=list)
+    max_depth: Optional[int] = None # 0 keeps only the top level items of the root toc
+
+    def __post_init__(self):
+        self.include = [path.strip("/").lower() for path in self.include]
+        self.exclude = [path.strip("/").lower() for path in self.exclude]
+
+    def match(self, node) -> Match:
+        if self.max_depth is not None and depth(node) > self.max_depth:
+            return Match.Skip
+        path = node_path(node)
+        url = node.url()
+        if any(under(path, rule) for rule in self.exclude) or \
+        any(fnmatchcase(url, glob) for glob in self.exclude_urls) or \
+        (node.toc_title and any(regex.search(pattern, node.toc_title, regex.IGNORECASE) for pattern in self.exclude_titles)):
+            return Match.Skip
+        if not self.has_includes() or inherited(node):
+            return Match.Keep
+        if any(under(path, rule) for rule in self.include) or \
+        any(fnmatchcase(url, glob) for glob in self.include_urls) or \
+        any(regex.search(pattern, node.toc_title, regex.IGNORECASE) for pattern in self.include_titles):
+            return Match.Keep
+        if self.include_titles and not node.toc_title:
+            return Match.Keep # named by its page heading, matched again once fetched
+        if self.include_urls or self.include_titles:
+            if node.isfile() and not is_branch(node):
+                return Match.Skip # a leaf page with nothing below it
+            # a match may be anywhere below, keep crawling tocs
+            return Match.Walk
+        if is_branch(node) or (not node.isfile() and any(under(rule, path) for rule in self.include)):
+            # branch children are inline and may point anywhere below base_uri
+            return Match.Walk
+        return Match.Skip
+
+    def has_includes(self):
+        return bool(self.include or self.include_urls or self.include_titles)
+
+def under(path, rule):
+    # path is rule or below it
+    return path == rule or path.startswith(f"{rule}/")
+
+def rank(node, paths) -> int:
+    # index of the first of paths node is under, len(paths) when none
+    path = node_path(node)
+    for idx, rule in enumerate(paths):
+        if under(path, rule):
+            return idx
+    return len(paths)
+
+def node_path(node):
+    # windows/win32/api/fileapi/nf-fileapi-createfilew -> fileapi/nf-fileapi-createfilew
+    path = node.folder().strip("/")
+    if node.isfile():
+        path = f"{path}/{node.href.rstrip('/').split('/')[-1]}".strip("/")
+    return path.lower()
+
+# toc imports this module, so nodes are told apart by their fields
+def is_node(obj):
+    return hasattr(obj, "toc_title")
+def is_toc(obj):
+    return hasattr(obj, "items") and hasattr(obj, "sub_tocs")
+def is_branch(obj):
+    return is_node(obj) and hasattr(obj, "children")
+
+def depth(node):
+    # Branch and Child ancestors across sub tocs, 0 for root toc items
+    count = 0
+    parent = node.parent
+    while is_node(parent) or is_toc(parent):
+        if is_node(parent):
+            count += 1
+        parent = parent.parent
+    return count
+
+def inherited(node):
+    # whether the nearest Branch or Child above node was selected
+    parent = node.parent
+    while is_toc(parent):
+        parent = parent.parent
+    return is_node(parent) and parent.selected
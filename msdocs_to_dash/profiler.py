@@ -0,0 +1,84 @@
+#!env python3
+
+from dataclasses import dataclass, field
+from contextlib import contextmanager
+from typing import List, Dict, Tuple
+from pathlib import Path
+import cProfile
+import logging
+import os
+import time
+
+@dataclass
+class NodeStats:
+    url: str
+    title: str
+    fetch_time: float
+    rewrite_time: float
+    size: int
+
+@dataclass
+class Profiler:
+    '''
+    Runs build stages under cProfile and writes <output>/profile/<stage>.pstats,
+    then reports the slowest and largest pages recorded on each Child.
+    '''
+    output: str = "./docs"
+    top: int = 20
+    stages: Dict[str, float] = field(default_factory=dict, init=False)
+
+    def profile_path(self, name=""):
+        return Path(self.output).joinpath("profile/", name)
+
+    @contextmanager
+    def stage(self, name):
+        os.makedirs(self.profile_path(), exist_ok=True)
+        prof = cProfile.Profile()
+        start = time.perf_counter()
+        prof.enable()
+        try:
+            yield prof
+        finally:
+            prof.disable()
+            self.stages[name] = time.perf_counter() - start
+            prof.dump_stats(str(self.profile_path(f"{name}.pstats")))
+            logging.info(f"Stage {name} took {self.stages[name]:.2f}s")
+
+    @staticmethod
+    def nodes(docset) -> List[NodeStats]:
+        # collect timings from every Child in the crawled tocs
+        results = list()
+        for source in docset.sources:
+            for toc in source._tocs:
+                for node in toc.nodes():
+                    if node.contents:
+                        results.append(NodeStats(
+                            node.url(), node.toc_title, node.fetch_time, node.rewrite_time, len(node.contents)
+                        ))
+        return results
+
+    def slowest(self, nodes) -> List[NodeStats]:
+        return sorted(nodes, key=lambda n: n.fetch_time + n.rewrite_time, reverse=True)[:self.top]
+
+    def largest(self, nodes) -> List[NodeStats]:
+        return sorted(nodes, key=lambda n: n.size, reverse=True)[:self.top]
+
+    def report(self, docset) -> str:
+        nodes = Profiler.nodes(docset)
+        lines = [f"{len(nodes)} pages"]
+        for name, seconds in self.stages.items():
+            lines.append(f"stage {name}: {seconds:.2f}s")
+        lines.append(f"\nslowest {self.top} (fetch s, rewrite s, bytes, url)")
+        for n in self.slowest(nodes):
+            lines.append(f"{n.fetch_time:8.3f} {n.rewrite_time:8.3f} {n.size:10d} {n.url}")
+        lines.append(f"\nlargest {self.top} (fetch s, rewrite s, bytes, url)")
+        for n in self.largest(nodes):
+            lines.append(f"{n.fetch_time:8.3f} {n.rewrite_time:8.3f} {n.size:10d} {n.url}")
+        return "\n".join(lines)
+
+    def write_report(self, docset):
+        os.makedirs(self.profile_path(), exist_ok=True)
+        report = self.report(docset)
+        with open(self.profile_path("report.txt"), 'w') as f:
+            f.write(report)
+        return report
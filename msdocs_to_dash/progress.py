@@ -0,0 +1,93 @@
+#!env python3
+
+from dataclasses import dataclass, field
+from collections import Counter
+from typing import TextIO, Optional
+import json
+import sys
+import threading
+import time
+
+EVENTS = ["discovered", "fetched", "rewritten", "written"]
+
+@dataclass
+class Progress:
+    '''
+    Counts crawl events and redraws a status line at most once per interval.
+    machine=True writes one json object per refresh instead, for orchestration.
+    '''
+    stream: TextIO = field(default=sys.stderr, repr=False)
+    interval: float = 1.0 # minimum seconds between refreshes
+    machine: bool = False
+    counts: Counter = field(default_factory=Counter)
+    requests: int = 0
+    bytes: int = 0
+    queue: int = 0 # tocs waiting to be crawled
+    _start: float = field(default_factory=time.monotonic, init=False, repr=False)
+    _last: float = field(default=float("-inf"), init=False, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    def __deepcopy__(self, memo):
+        # copies of a docset keep reporting to the same status line
+        return self
+
+    def start(self):
+        # a new build, rates and the eta only cover what happens from now on
+        with self._lock:
+            self.counts = Counter()
+            self.requests, self.bytes, self.queue = 0, 0, 0
+            self._start, self._last = time.monotonic(), float("-inf")
+
+    def add(self, event, count=1, nbytes=0, request=False):
+        with self._lock:
+            self.counts[event] += count
+            self.bytes += nbytes
+            if request:
+                self.requests += 1
+        self.refresh()
+
+    def set_queue(self, depth):
+        self.queue = depth
+        self.refresh()
+
+    def snapshot(self) -> dict:
+        elapsed = max(time.monotonic() - self._start, 1e-9)
+        fetched = self.counts["fetched"]
+        remaining = max(self.counts["discovered"] - fetched, 0)
+        eta = None
+        if fetched:
+            eta = round(remaining * elapsed / fetched, 1)
+        data = {event: self.counts[event] for event in EVENTS}
+        data.update({
+            "elapsed": round(elapsed, 1),
+            "requests_per_sec": round(self.requests / elapsed, 2),
+            "bytes_per_sec": round(self.bytes / elapsed),
+            "queue": self.queue,
+            "eta": eta,
+        })
+        return data
+
+    def format(self, data) -> str:
+        eta = "?" if data["eta"] is None else f"{data['eta']:.0f}s"
+        return (f"discovered {data['discovered']} fetched {data['fetched']} "
+                f"rewritten {data['rewritten']} written {data['written']} | "
+                f"{data['requests_per_sec']:.1f} req/s {data['bytes_per_sec'] / 1024:.0f} KiB/s | "
+                f"queue {data['queue']} eta {eta}")
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._last < self.interval:
+            return
+        self._last = now
+        data = self.snapshot()
+        if self.machine:
+            self.stream.write(json.dumps(data) + "\n")
+        else:
+            self.stream.write("\r" + self.format(data))
+        self.stream.flush()
+
+    def finish(self):
+        self.refresh(force=True)
+        if not self.machine:
+            self.stream.write("\n")
+            self.stream.flush()
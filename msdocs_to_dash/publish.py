@@ -0,0 +1,119 @@
+#!env python3
+
+from dataclasses import dataclass, field
+from typing import Optional, Set
+from pathlib import Path
+import logging
+import os
+import shutil
+import sqlite3
+import time
+
+from msdocs_to_dash.sqlite import SqLiteDb
+
+@dataclass
+class Publisher:
+    '''
+    Publishes a usable docset at <output>/<title>.partial.docset while the
+    fetch is still going, every pages fetched pages or every minutes minutes.
+    Pages only get added to the published tree, each written once, and a
+    snapshot is made current by swapping in a copy of the index atomically,
+    so every page the index lists is already there.
+    '''
+    output: str
+    pages: int = 500
+    minutes: float = 5.0
+    snapshots: int = field(default=0, init=False)
+    _fetched: int = field(default=0, init=False, repr=False)
+    _last: float = field(default_factory=time.monotonic, init=False, repr=False)
+    _written: Set[str] = field(default_factory=set, init=False, repr=False) # page and theme paths
+    _db: Optional[SqLiteDb] = field(default=None, init=False, repr=False)
+
+    def __deepcopy__(self, memo):
+        # copies of a docset, e.g. other locales, publish their own snapshots
+        return Publisher(self.output, self.pages, self.minutes)
+
+    def root(self, docset) -> Path:
+        return Path(self.output).joinpath(f"{docset.title}.partial.docset")
+    def work_path(self, docset) -> Path:
+        return Path(self.output).joinpath(f".{docset.title}.snapshot")
+
+    def tick(self) -> bool:
+        # call once per fetched page, True when a snapshot is due
+        self._fetched += 1
+        return self._fetched >= self.pages or time.monotonic() - self._last >= self.minutes * 60
+
+    def publish(self, docset, webdriver) -> Path:
+        '''
+        Adds the pages rewritten since the last snapshot and makes them current.
+        returns: the published docset folder
+        '''
+        work = self.work_path(docset)
+        if self._db is None:
+            if work.exists():
+                shutil.rmtree(work) # left over from an earlier build
+            os.makedirs(docset.theme_path(work), exist_ok=True)
+            if not docset._ico:
+                docset._ico = docset.get_ico(webdriver)
+            self.write(docset.ico_path(work), docset._ico)
+            self.write(docset.plist_path(work), docset.make_plist())
+            # rows go to a private index, each snapshot publishes a copy of it
+            self._db = SqLiteDb.new(str(work.with_name(f"{work.name}.dsidx")), docset.fts)
+            link = self.root(docset).with_name(f"{self.root(docset).name}.tmp")
+            if link.is_symlink():
+                link.unlink()
+            os.symlink(work.name, link)
+        documents = docset.documents_path(work)
+        added = 0
+        for source in docset.sources:
+            if source.index and source.index.contents and "index.html" not in self._written:
+                self.write(documents.joinpath("index.html"), source.index.contents)
+                self._written.add("index.html")
+            for node in source.nodes():
+                path = str(node.file())
+                if not node.selected or not node.contents or node.stale or path in self._written:
+                    continue
+                for uri in node.css_uris + node.js_uris:
+                    self.add_theme(docset, webdriver, uri)
+                self.write(documents.joinpath(path), node.contents)
+                self._written.add(path)
+                node.db_insert(self._db)
+                added += 1
+        for slimmer in docset.slimmers():
+            for path, data in slimmer.files(docset.theme_path(work)):
+                if str(path) not in self._written:
+                    self.write(path, data)
+                    self._written.add(str(path))
+        self._db.db.commit()
+        # the index goes last, pages it lists are already in place
+        tmp_path = docset.database_path(work).with_name("docSet.dsidx.tmp")
+        target = sqlite3.connect(str(tmp_path))
+        self._db.db.backup(target)
+        target.close()
+        os.replace(tmp_path, docset.database_path(work))
+        link = self.root(docset).with_name(f"{self.root(docset).name}.tmp")
+        if link.is_symlink():
+            os.replace(link, self.root(docset))
+        self.snapshots += 1
+        self._fetched, self._last = 0, time.monotonic()
+        logging.info(f"Published snapshot {self.snapshots} of {docset.title}: {added} new pages, {len(self._written)} files")
+        return self.root(docset)
+
+    def add_theme(self, docset, webdriver, uri):
+        path = docset.theme_file_path(uri, self.work_path(docset))
+        if str(path) not in self._written:
+            self.write(path, webdriver.get_binary(uri))
+            self._written.add(str(path))
+
+    def write(self, path, data):
+        # readers of the published tree never see half a file
+        os.makedirs(Path(path).parent, exist_ok=True)
+        tmp_path = Path(path).with_name(f"{Path(path).name}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def close(self):
+        if self._db:
+            self._db.close()
+            self._db = None
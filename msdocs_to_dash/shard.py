@@ -0,0 +1,251 @@
+#!env python3
+
+from dataclasses import dataclass
+from contextlib import contextmanager
+from typing import Optional, List
+from pathlib import Path
+from tarfile import TarFile
+import copy
+import hashlib
+import logging
+import multiprocessing
+import os
+import shutil
+import socket
+import threading
+import time
+
+from msdocs_to_dash.sqlite import SqLiteDb
+from msdocs_to_dash.tar import tar_write_bytes
+from msdocs_to_dash.filters import is_node, is_toc
+
+@dataclass
+class Shard:
+    '''
+    One of count slices of a build. Subtrees are assigned by the first folder
+    below base_uri, so fileapi/ and everything beneath it land in one shard.
+    Pages directly below base_uri, like the index, belong to shard 0.
+    '''
+    index: int
+    count: int
+
+    def owns(self, key) -> bool:
+        if not key:
+            return self.index == 0
+        return int(hashlib.sha1(key.encode('utf-8')).hexdigest()[:8], 16) % self.count == self.index
+
+def shard_key(path, base_uri=""):
+    # windows/win32/api/fileapi/nf-fileapi-createfilew, windows/win32/api -> fileapi
+    path = path.strip("/")
+    base_uri = base_uri.strip("/")
+    if base_uri and (path == base_uri or path.startswith(f"{base_uri}/")):
+        path = path[len(base_uri):]
+    return path.strip("/").split("/")[0].lower()
+
+def in_root_toc(node):
+    # whether node was parsed from the toc.json of the source itself
+    parent = node.parent
+    while not is_toc(parent):
+        parent = parent.parent
+    return not is_node(parent.parent)
+
+@dataclass
+class ShardQueue:
+    '''
+    A shared directory used as the work queue of a sharded build. Workers on
+    any host claim a shard by creating shard-NNNN.claim exclusively, build it
+    into shard-NNNN/ and mark it with shard-NNNN.done once complete.
+    Claims of workers that died are taken over: on the same host once the
+    process is gone, from other hosts once not refreshed for expire seconds.
+    Workers refresh their claim every expire / 4 seconds while they build.
+    '''
+    path: str
+    count: int
+    expire: float = 10 * 60
+
+    def __post_init__(self):
+        os.makedirs(self.path, exist_ok=True)
+
+    def shard_path(self, index):
+        return Path(self.path).joinpath(f"shard-{index:04d}")
+    def marker(self, index, state):
+        return Path(self.path).joinpath(f"shard-{index:04d}.{state}")
+
+    def claim(self) -> Optional[Shard]:
+        for index in range(self.count):
+            if self.try_claim(index) or (self.release_stale(index) and self.try_claim(index)):
+                return Shard(index, self.count)
+        return None
+
+    def try_claim(self, index) -> bool:
+        try:
+            fd = os.open(self.marker(index, "claim"), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as f:
+            f.write(f"{socket.gethostname()} {os.getpid()}\n")
+        return True
+
+    @contextmanager
+    def heartbeat(self, shard):
+        # keeps the claim of shard fresh while it is built
+        stop = threading.Event()
+        def beat():
+            while not stop.wait(self.expire / 4):
+                try:
+                    os.utime(self.marker(shard.index, "claim"))
+                except FileNotFoundError:
+                    return
+        thread = threading.Thread(target=beat, name="shard-heartbeat", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def is_stale(self, index) -> bool:
+        # whether the worker holding the claim of an unfinished shard is gone
+        marker = self.marker(index, "claim")
+        if self.marker(index, "done").exists():
+            return False
+        try:
+            host, pid = marker.read_text().split()
+            age = time.time() - marker.stat().st_mtime
+        except (FileNotFoundError, ValueError):
+            return False # released meanwhile, or still being written
+        if host != socket.gethostname():
+            return age > self.expire
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass # alive, owned by another user
+        return False
+
+    def release_stale(self, index) -> bool:
+        # only one of the workers racing for a stale claim gets to rename it
+        if not self.is_stale(index):
+            return False
+        released = self.marker(index, f"stale-{socket.gethostname()}-{os.getpid()}")
+        try:
+            os.rename(self.marker(index, "claim"), released)
+        except FileNotFoundError:
+            return False
+        released.unlink()
+        logging.info(f"Reclaiming shard {index + 1}/{self.count} from a worker that died")
+        return True
+
+    def finish(self, shard):
+        self.marker(shard.index, "done").touch()
+
+    def missing(self) -> List[int]:
+        return [index for index in range(self.count) if not self.marker(index, "done").exists()]
+
+def build_shard(docset, shard, output, webdriver):
+    # crawls, rewrites and writes one shard as a regular docset folder
+    logging.info(f"Building shard {shard.index + 1}/{shard.count} of {docset.title}")
+    for source in docset.sources:
+        source.shard = shard
+    docset.get_contents(webdriver, output)
+    docset.get_themes(webdriver)
+    docset.write_contents(output)
+
+def work(docset, queue, webdriver=None):
+    '''
+    Builds shards from queue until none are left unclaimed.
+    Each shard starts from a fresh copy of docset.
+    '''
+    if webdriver is None:
+        from msdocs_to_dash.webdriver import WebDriver
+        webdriver = WebDriver()
+    while True:
+        shard = queue.claim()
+        if not shard:
+            return
+        output = queue.shard_path(shard.index)
+        if output.exists():
+            shutil.rmtree(output) # left over from a worker that died
+        with queue.heartbeat(shard):
+            build_shard(copy.deepcopy(docset), shard, output, webdriver)
+        queue.finish(shard)
+
+def configured_docset(title):
+    # a fresh copy of the docset named title in downloader.DOC_SETS
+    from msdocs_to_dash.downloader import DOC_SETS
+    for docset in DOC_SETS:
+        if docset.title == title:
+            return copy.deepcopy(docset)
+    raise ValueError("No configured docset", title)
+
+def work_configured(title, queue):
+    # worker process entry point, only the title and queue are pickled
+    work(configured_docset(title), queue)
+
+def build_sharded(docset, count, workdir, output, processes=None) -> Path:
+    '''
+    Local sharded build, one worker process per shard unless processes is given.
+    docset is one of downloader.DOC_SETS, workers rebuild it from its title so
+    nothing else has to be pickled, as spawned processes require.
+    '''
+    configured_docset(docset.title) # fail before starting any worker
+    queue = ShardQueue(workdir, count)
+    workers = [
+        multiprocessing.Process(target=work_configured, args=(docset.title, queue))
+        for _ in range(processes or count)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return merge(docset, queue, output)
+
+def merge(docset, queue, output) -> Path:
+    '''
+    Merges every shard of queue into output and packages it. Shards are read in
+    order and files in sorted order, so the result does not depend on which
+    worker built what. A path written by several shards keeps the first copy,
+    index rows go through SqLiteDb.insert so its uniqueness rules still apply.
+    returns: path of the package
+    '''
+    missing = queue.missing()
+    if missing:
+        raise RuntimeError("Shards are not built yet", missing)
+    database = docset.database_path()
+    db = None
+    files = dict() # archive name -> merged file
+    for index in range(queue.count):
+        root = queue.shard_path(index)
+        shard_db = SqLiteDb.open(root.joinpath(database))
+        if db is None:
+            db_path = docset.database_path(output)
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+            db = SqLiteDb.new(db_path, shard_db.fts)
+        for path in sorted(p for p in root.rglob("*") if p.is_file()):
+            name = path.relative_to(root)
+            if name == database or name in files:
+                continue
+            target = Path(output).joinpath(name)
+            os.makedirs(target.parent, exist_ok=True)
+            shutil.copyfile(path, target)
+            files[name] = target
+        shard_db.cur.execute('SELECT name, type, path FROM searchIndex ORDER BY id')
+        for name, rec_type, path in shard_db.cur.fetchall():
+            db.insert(name, rec_type, path)
+        if shard_db.fts and db.fts:
+            shard_db.cur.execute('SELECT name, path, body FROM searchText ORDER BY rowid')
+            for name, path, body in shard_db.cur.fetchall():
+                db.insert_text(name, path, body)
+        shard_db.db.close()
+    db.close()
+    files[database] = docset.database_path(output)
+    tar_path = Path(output).joinpath(f"{docset.title}.docset.tar")
+    tmp_path = tar_path.with_name(f"{tar_path.name}.tmp")
+    with TarFile.open(str(tmp_path), "w:gz") as tar:
+        for name in sorted(files, key=str):
+            with open(files[name], 'rb') as f:
+                tar_write_bytes(tar, name, f.read())
+    os.replace(tmp_path, tar_path)
+    logging.info(f"Merged {queue.count} shards of {docset.title}: {len(files)} files")
+    return tar_path
@@ -0,0 +1,165 @@
+#!env python3
+
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Set, TextIO
+from pathlib import Path
+from tarfile import TarFile
+import json
+import os
+import shutil
+
+from msdocs_to_dash.sqlite import SqLiteDb
+from msdocs_to_dash.tar import tar_write_bytes
+
+class Sink(ABC):
+    '''
+    One output of a build, fed by DocSet.emit in a single pass over the
+    crawled tree: open before anything, index once per source, add for every
+    node, then close, which returns the path of what was written.
+    '''
+    def open(self, docset):
+        pass
+    def index(self, source):
+        pass
+    def add(self, node):
+        pass
+    @abstractmethod
+    def close(self, docset) -> Path:
+        pass
+
+def write_files(docset, root):
+    # icon, plist and themes of a docset folder below root
+    os.makedirs(docset.theme_path(root), exist_ok=True)
+    with open(docset.ico_path(root), 'wb') as f:
+        f.write(docset._ico)
+    with open(docset.plist_path(root), 'wb') as f:
+        f.write(docset.make_plist())
+    for path, data in docset.theme_files():
+        with open(docset.theme_file_path(path, root), 'wb') as f:
+            f.write(data)
+
+@dataclass
+class DashTar(Sink):
+    # <output>/<title>.docset.tar as published for Dash, same as make_package
+    output: str
+    path: Path = field(default=None, init=False)
+    _tar: TarFile = field(default=None, init=False, repr=False)
+    _db: SqLiteDb = field(default=None, init=False, repr=False)
+
+    def open(self, docset):
+        self.path = Path(self.output).joinpath(f"{docset.title}.docset.tar")
+        os.makedirs(self.path.parent, exist_ok=True)
+        self._db = None if docset.database() else docset.new_database(self.output)
+        self._tar = TarFile.open(str(self.path.with_name(f"{self.path.name}.tmp")), "w:gz")
+        tar_write_bytes(self._tar, docset.ico_path(), docset._ico)
+        tar_write_bytes(self._tar, docset.plist_path(), docset.make_plist())
+        for path, data in docset.theme_files():
+            tar_write_bytes(self._tar, docset.theme_file_path(path), data)
+
+    def index(self, source):
+        source.index.write_index_tar(self._tar)
+
+    def add(self, node):
+        node.write_tar(self._tar)
+        if self._db:
+            node.db_insert(self._db)
+
+    def close(self, docset) -> Path:
+        if self._db:
+            self._db.close()
+        self._tar.add(docset.database() or docset.database_path(self.output), docset.database_path())
+        self._tar.close()
+        # swapped in once complete, like make_package
+        os.replace(self.path.with_name(f"{self.path.name}.tmp"), self.path)
+        return self.path
+
+@dataclass
+class ZealDocset(Sink):
+    '''
+    <output>/<title>.docset folder, the layout Zeal installs from. Built
+    beside the previous one and swapped in once complete.
+    '''
+    output: str
+    path: Path = field(default=None, init=False)
+    _tmp: Path = field(default=None, init=False, repr=False)
+    _documents: Path = field(default=None, init=False, repr=False)
+    _db: SqLiteDb = field(default=None, init=False, repr=False)
+
+    def open(self, docset):
+        self.path = Path(self.output).joinpath(f"{docset.title}.docset")
+        self._tmp = self.path.with_name(f"{self.path.name}.tmp")
+        if self._tmp.exists():
+            shutil.rmtree(self._tmp)
+        write_files(docset, self._tmp)
+        self._documents = docset.documents_path(self._tmp)
+        if docset.database():
+            self._db = None
+            shutil.copyfile(docset.database(), docset.database_path(self._tmp))
+        else:
+            self._db = docset.new_database(self._tmp)
+
+    def index(self, source):
+        source.index.write_index(self._documents)
+
+    def add(self, node):
+        node.write(self._documents)
+        if self._db:
+            node.db_insert(self._db)
+
+    def close(self, docset) -> Path:
+        if self._db:
+            self._db.close()
+        if self.path.exists():
+            shutil.rmtree(self.path)
+        os.replace(self._tmp, self.path)
+        return self.path
+
+@dataclass
+class NdjsonExport(Sink):
+    '''
+    <output>/<title>.ndjson with one json object per indexed page, for search
+    services. Each line has title, type, path, url and text, plus the page
+    itself with html=True.
+    '''
+    output: str
+    html: bool = False
+    path: Path = field(default=None, init=False)
+    _stream: TextIO = field(default=None, init=False, repr=False)
+    _paths: Set[str] = field(default_factory=set, init=False, repr=False)
+
+    def open(self, docset):
+        self.path = Path(self.output).joinpath(f"{docset.title}.ndjson")
+        self._paths = set()
+        os.makedirs(self.path.parent, exist_ok=True)
+        self._stream = open(self.path.with_name(f"{self.path.name}.tmp"), 'w', encoding='utf-8')
+
+    def write(self, record: Dict[str, Any], contents: Optional[bytes]):
+        if record["path"] in self._paths:
+            return # like the index, the first node of a page names it
+        self._paths.add(record["path"])
+        if self.html:
+            record["html"] = (contents or b'').decode('utf-8', 'replace')
+        self._stream.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def index(self, source):
+        page = source.index.page
+        self.write({
+            "title": source.title, "type": "Index", "path": "index.html",
+            "url": page.url() if page else source.get_base_url(), "text": page.text if page else "",
+        }, source.index.contents)
+
+    def add(self, node):
+        if not node.selected:
+            return
+        self.write({
+            "title": node.toc_title, "type": str(node.dash_type()), "path": str(node.file()),
+            "url": node.url(), "text": node.text,
+        }, node.contents)
+
+    def close(self, docset) -> Path:
+        self._stream.close()
+        os.replace(self.path.with_name(f"{self.path.name}.tmp"), self.path)
+        return self.path
+
+SINKS = {"dash": DashTar, "zeal": ZealDocset, "ndjson": NdjsonExport}
@@ -0,0 +1,59 @@
+#!env python3
+
+from dataclasses import dataclass, field
+from fnmatch import fnmatchcase
+from typing import BinaryIO, Iterator, List, Tuple
+from xml.etree import ElementTree
+import gzip
+import io
+import logging
+
+@dataclass
+class Sitemap:
+    '''
+    Page discovery from a sitemap or sitemap index, as an alternative to
+    walking every toc.json. url may also be a local file, e.g. a mirror or a
+    stand-in for tests. sitemaps are globs over child sitemap urls to follow,
+    so a large index is not read whole, all are followed when empty.
+    '''
+    url: str
+    sitemaps: List[str] = field(default_factory=list)
+
+    def open(self, webdriver, url) -> BinaryIO:
+        # local files are parsed straight from disk, remote ones from the response
+        if url.startswith("file://") or "://" not in url:
+            path = url[len("file://"):] if url.startswith("file://") else url
+            return gzip.open(path, 'rb') if path.endswith(".gz") else open(path, 'rb')
+        data = webdriver.get_binary(url)
+        if data[:2] == b"\x1f\x8b":
+            data = gzip.decompress(data)
+        return io.BytesIO(data)
+
+    def entries(self, webdriver, url) -> Iterator[Tuple[str, str, str]]:
+        '''
+        Parses one sitemap incrementally, dropping each entry once read.
+        yields: (kind, loc, lastmod) with kind "url" or "sitemap"
+        '''
+        with self.open(webdriver, url) as stream:
+            for _, elem in ElementTree.iterparse(stream):
+                kind = elem.tag.rsplit("}", 1)[-1]
+                if kind not in ["url", "sitemap"]:
+                    continue
+                values = {child.tag.rsplit("}", 1)[-1]: (child.text or "").strip() for child in elem}
+                elem.clear()
+                if values.get("loc"):
+                    yield kind, values["loc"], values.get("lastmod", "")
+
+    def pages(self, webdriver, base_url) -> Iterator[Tuple[str, str]]:
+        # (url, lastmod) of every page at or below base_url, following child sitemaps
+        prefix = f"{base_url.rstrip('/')}/".lower()
+        todo = [self.url]
+        while todo:
+            url = todo.pop(0)
+            logging.debug("Reading sitemap %s", url)
+            for kind, loc, lastmod in self.entries(webdriver, url):
+                if kind == "sitemap":
+                    if not self.sitemaps or any(fnmatchcase(loc, glob) for glob in self.sitemaps):
+                        todo.append(loc)
+                elif f"{loc.rstrip('/')}/".lower().startswith(prefix):
+                    yield loc, lastmod
@@ -0,0 +1,135 @@
+#!env python3
+
+from dataclasses import dataclass, field
+from collections import Counter
+from typing import List, Dict, Tuple
+from pathlib import Path
+import hashlib
+import threading
+import regex
+
+RULES = ["json_ld", "inline_scripts", "data_bi", "hidden", "feedback", "hoist_styles"]
+# rules that never touch page content, inline_scripts and hidden also drop
+# tabs and collapsed sections that scripts would show
+SAFE_RULES = ["json_ld", "data_bi", "feedback"]
+DISPLAY_NONE = regex.compile(r"display\s*:\s*none", regex.IGNORECASE)
+FEEDBACK = regex.compile(r"feedback", regex.IGNORECASE)
+
+@dataclass
+class Slimmer:
+    '''
+    Strips page weight that is useless offline during rewrite_html.
+    rules picks from RULES, SAFE_RULES by default, saved counts the bytes each
+    rule removed. hoist_styles moves inline <style> blocks of at least
+    hoist_bytes into content addressed _themes_/inline-<sha1>.css files, once
+    a block was seen on another page too.
+    '''
+    rules: List[str] = field(default_factory=lambda: list(SAFE_RULES))
+    hoist_bytes: int = 256
+    saved: Counter = field(default_factory=Counter)
+    # sha1 -> css of hoisted style blocks
+    blocks: Dict[str, str] = field(default_factory=dict, repr=False)
+    # sha1 -> pages a style block was found on, by this copy and before it was made
+    seen: Counter = field(default_factory=Counter, repr=False)
+    known: Counter = field(default_factory=Counter, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    def __post_init__(self):
+        unknown = set(self.rules) - set(RULES)
+        if unknown:
+            raise ValueError("Unknown slimming rules", unknown)
+
+    def __getstate__(self):
+        # locks cannot be copied or pickled, each copy gets its own
+        state = dict(self.__dict__)
+        del state["_lock"]
+        return state
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def slim(self, soup):
+        for rule in RULES:
+            if rule in self.rules:
+                getattr(self, rule)(soup)
+        return soup
+
+    def remove(self, rule, tags):
+        for tag in tags:
+            if tag.parent is None:
+                continue # inside something already removed
+            self.count(rule, len(str(tag)))
+            tag.decompose()
+
+    def count(self, rule, nbytes):
+        with self._lock:
+            self.saved[rule] += nbytes
+
+    def json_ld(self, soup):
+        self.remove("json_ld", soup.find_all("script", {"type": "application/ld+json"}))
+
+    def inline_scripts(self, soup):
+        self.remove("inline_scripts", soup.find_all("script", src=False))
+
+    def data_bi(self, soup):
+        for tag in soup.find_all(True):
+            for attr in [attr for attr in tag.attrs if attr.startswith("data-bi-")]:
+                self.count("data_bi", len(attr) + len(str(tag[attr])) + 4) # ' attr=""'
+                del tag[attr]
+
+    def hidden(self, soup):
+        tags = soup.find_all(attrs={"hidden": True})
+        tags += soup.find_all(style=DISPLAY_NONE)
+        self.remove("hidden", tags)
+
+    def feedback(self, soup):
+        tags = soup.find_all(id=FEEDBACK)
+        tags += soup.find_all(class_=FEEDBACK)
+        self.remove("feedback", tags)
+
+    def hoist_styles(self, soup):
+        styles = list()
+        for style in soup.find_all("style"):
+            css = style.string or ""
+            if len(css.encode('utf-8')) >= self.hoist_bytes:
+                styles.append((style, css, hashlib.sha1(css.encode('utf-8')).hexdigest()))
+        with self._lock:
+            self.seen.update(set(digest for _, _, digest in styles))
+        for style, css, digest in styles:
+            with self._lock:
+                if self.known[digest] + self.seen[digest] < 2:
+                    continue # only on this page so far, a shared file would not save anything
+                self.blocks.setdefault(digest, css)
+            link = soup.new_tag("link", href=f"/_themes_/{hoisted_name(digest)}", rel="stylesheet")
+            self.count("hoist_styles", len(str(style)) - len(str(link)))
+            style.replace_with(link)
+
+    def worker(self) -> 'Slimmer':
+        # same rules with empty counts, for rewriting a page elsewhere
+        return Slimmer(list(self.rules), self.hoist_bytes, known=self.known + self.seen)
+
+    def merge(self, other: 'Slimmer'):
+        # takes the counts and hoisted blocks of a worker copy
+        with self._lock:
+            self.saved.update(other.saved)
+            self.seen.update(other.seen)
+            for digest, css in other.blocks.items():
+                self.blocks.setdefault(digest, css)
+
+    def files(self, theme_path) -> List[Tuple[Path, bytes]]:
+        # hoisted blocks as theme files, ready for DocCommon._css_files
+        return [
+            (Path(theme_path).joinpath(hoisted_name(digest)), css.encode('utf-8'))
+            for digest, css in sorted(self.blocks.items())
+        ]
+
+    def report(self):
+        total = sum(self.saved.values())
+        rules = ", ".join(f"{rule}: {self.saved[rule]}" for rule in RULES if rule in self.rules)
+        return f"Slimming saved {total} bytes ({rules})"
+
+def hoisted_name(digest):
+    return f"inline-{digest[:16]}.css"
+
+def is_hoisted(href):
+    return href.startswith("/_themes_/inline-")
@@ -1,36 +1,53 @@
 #!env python3
 
 from dataclasses import dataclass, field
+from typing import Any, Optional, Set
 import logging
 from enum import Enum, auto
+import multiprocessing
 import os
+import queue
 import sys
-import regex
 import sqlite3
+import threading
 from sqlite3 import Connection, Cursor
 
 @dataclass
 class SqLiteDb():
     path: str
+    fts: bool = False
     db: Connection = field(init=False,repr=False)
     cur: Cursor = field(init=False,repr=False)
+    # paths already in searchText, its path column cannot be indexed
+    text_paths: Set[str] = field(default_factory=set, init=False, repr=False)
 
     def __post_init__(self):
         self.db = sqlite3.connect(self.path)
         self.cur = self.db.cursor()
     
     @staticmethod
-    def new(path):
+    def new(path, fts=False):
         if os.path.exists(path):
             os.remove(path)
-        db = SqLiteDb(path)
+        db = SqLiteDb(path, fts)
         db.cur.execute('CREATE TABLE searchIndex(id INTEGER PRIMARY KEY, name TEXT, type TEXT, path TEXT);')
         db.cur.execute('CREATE UNIQUE INDEX anchor ON searchIndex (name, type, path);')
+        db.cur.execute('CREATE INDEX anchor_path ON searchIndex (path);') # for the path lookup of insert
+        if fts:
+            # full text index of page bodies for search_text, not read by Dash
+            # itself, path is only stored for lookup
+            db.cur.execute('CREATE VIRTUAL TABLE searchText USING fts5(name, path UNINDEXED, body);')
         return db
     
     @staticmethod
     def open(path):
-        return SqLiteDb(path)
+        db = SqLiteDb(path)
+        db.cur.execute("SELECT name FROM sqlite_master WHERE name = 'searchText'")
+        db.fts = db.cur.fetchone() is not None
+        if db.fts:
+            db.cur.execute('SELECT path FROM searchText')
+            db.text_paths = set(path for (path,) in db.cur.fetchall())
+        return db
     
     def close(self):
         self.db.commit()
@@ -51,9 +68,114 @@ class SqLiteDb():
 
         if dbpath is None and dbname is None:
             self.cur.execute('INSERT OR IGNORE INTO searchIndex(name, type, path) VALUES (?,?,?)', (name, rec_type, path))
-            logging.info(f"Created {name} record")
+            logging.debug("Created %s record", name)
         else:
-            logging.debug(f'{name} record exists')
+            logging.debug("%s record exists", name)
+
+    def insert_text(self, name, path, body):
+        # add page text to the full text index, ignored when created without one
+        if not self.fts or not body:
+            return
+        if not isinstance(path, str):
+            path = str(path)
+        if path not in self.text_paths:
+            self.text_paths.add(path)
+            self.cur.execute('INSERT INTO searchText(name, path, body) VALUES (?,?,?)', (name, path, body))
+
+    def search_text(self, query, limit=20):
+        # returns [(name, path), ...] ordered by rank
+        self.cur.execute(
+            'SELECT name, path FROM searchText WHERE searchText MATCH ? ORDER BY rank LIMIT ?',
+            (query, limit))
+        return self.cur.fetchall()
+
+@dataclass
+class IndexWriter:
+    '''
+    Owns a new SqLiteDb on its own thread and takes rows through a bounded
+    queue, so insert and insert_text can be called from any thread while the
+    crawl goes on. Rows are committed every batch rows, or once the queue
+    stays empty for linger seconds. With processes=True the queue is a
+    multiprocessing one and the writer can be passed to multiprocessing.Process
+    as a producer. Like the queue it can only travel that way, pickling it
+    for anything else, e.g. a process pool, raises RuntimeError.
+    '''
+    path: str
+    fts: bool = False
+    batch: int = 500
+    maxsize: int = 10000 # rows waiting before producers block
+    linger: float = 0.5
+    processes: bool = False
+    rows: int = field(default=0, init=False)
+    commits: int = field(default=0, init=False)
+    _queue: Any = field(default=None, init=False, repr=False)
+    _thread: Optional[threading.Thread] = field(default=None, init=False, repr=False)
+    _error: Optional[Exception] = field(default=None, init=False, repr=False)
+
+    def __post_init__(self):
+        self.path = str(self.path)
+        self._queue = multiprocessing.Queue(self.maxsize) if self.processes else queue.Queue(self.maxsize)
+        self._thread = threading.Thread(target=self.run, name="index-writer", daemon=True)
+        self._thread.start()
+
+    def __getstate__(self):
+        # only the queue travels, the copy can insert but not close
+        state = dict(self.__dict__)
+        state["_thread"] = None
+        return state
+
+    def insert(self, name, rec_type, path):
+        self._queue.put(("index", str(name), str(rec_type), str(path)))
+
+    def insert_text(self, name, path, body):
+        if self.fts and body:
+            self._queue.put(("text", str(name), str(path), body))
+
+    def run(self):
+        db = SqLiteDb.new(self.path, self.fts)
+        pending = 0
+        while True:
+            try:
+                row = self._queue.get(timeout=self.linger) if pending else self._queue.get()
+            except queue.Empty:
+                pending = self.commit(db)
+                continue
+            if row is None:
+                break
+            if self._error:
+                continue # keep draining so producers do not block
+            try:
+                kind, *values = row
+                if kind == "index":
+                    db.insert(*values)
+                else:
+                    db.insert_text(*values)
+            except Exception as e:
+                self._error = e
+                continue
+            self.rows += 1
+            pending += 1
+            if pending >= self.batch:
+                pending = self.commit(db)
+        db.close()
+
+    def commit(self, db) -> int:
+        db.db.commit()
+        self.commits += 1
+        return 0
+
+    def close(self):
+        # waits for every queued row, call from the thread that made the writer
+        if self._thread is None:
+            raise RuntimeError("Only the IndexWriter that started the thread can close it")
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        if self._error:
+            raise RuntimeError("Index writer failed", self.path) from self._error
+
+    def closed(self) -> bool:
+        return self._thread is None
 
 class Type(Enum):
     # type = [alternative keywords]
@@ -138,6 +260,7 @@ class Type(Enum):
     
     @staticmethod
     def from_str(text):
+        import regex # only naming pages needs it, reading an index does not
         def search(text, keyword):
             # regex.search(f"(^|\s){member[0]}s?(\s|$)", text, regex.IGNORECASE)
             return regex.search(f"(^|\s){keyword}?(\s|$)", text, regex.IGNORECASE)
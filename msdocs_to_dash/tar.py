@@ -1,6 +1,19 @@
 from tarfile import TarFile, TarInfo
 import io
 
+class BufferReader(io.RawIOBase):
+    # file-like view over bytes/memoryview that hands out slices instead of copies
+    def __init__(self, data):
+        self._view = memoryview(data).cast("B")
+        self._pos = 0
+    def readable(self):
+        return True
+    def read(self, size=-1):
+        end = len(self._view) if size is None or size < 0 else self._pos + size
+        chunk = self._view[self._pos:end]
+        self._pos += len(chunk)
+        return chunk
+
 def tar_write(tar, name, len, data):
     if not isinstance(name, str):
         name = str(name)
@@ -15,6 +28,7 @@ def tar_write(tar, name, len, data):
     info.mode = 444
     tar.addfile(tarinfo=info, fileobj=data)
 def tar_write_bytes(tar, name, data):
-    tar_write(tar, name, len(data), io.BytesIO(data))
+    # accepts bytes, bytearray or memoryview without copying the buffer
+    tar_write(tar, name, memoryview(data).nbytes, BufferReader(data))
 def tar_write_str(tar, name, data):
-    tar_write_bytes(tar, name, data.encode('utf-8'))
\ No newline at end of file
+    tar_write_bytes(tar, name, data.encode('utf-8'))
@@ -4,21 +4,38 @@ from dataclasses import dataclass, field
 from typing import Union, Optional, List, Set, Tuple
 import logging
 import json
+import hashlib
 import os
 import regex
+import time
 from pathlib import Path
-from urllib.parse import quote
-from bs4 import BeautifulSoup as bs, Tag
+from urllib.parse import quote, urljoin
 
 from msdocs_to_dash.sqlite import SqLiteDb, Type
 from msdocs_to_dash.tar import tar_write_str, tar_write_bytes
+from msdocs_to_dash.filters import Match
+from msdocs_to_dash.slim import is_hoisted
+from msdocs_to_dash.assets import is_bundle
+from msdocs_to_dash.cache import PageStore
 
 @dataclass
 class Child:
     parent: Union["Toc", "Branch"] = field(repr=False)
     toc_title: str
     href: Optional[str] = field(default="") # dirs must end in /
-    contents: Optional[str] = field(default="", init=False, repr=False)
+    contents: Optional[bytes] = field(default=b'', init=False, repr=False)
+    text: Optional[str] = field(default="", init=False, repr=False) # plain text for fts
+    fetch_time: float = field(default=0.0, init=False, repr=False) # seconds, for profiling
+    rewrite_time: float = field(default=0.0, init=False, repr=False)
+    validator: Tuple[str, str] = field(default=("", ""), init=False, repr=False) # (etag, last-modified)
+    css_uris: List[str] = field(default_factory=list, init=False, repr=False) # found during rewrite
+    js_uris: List[str] = field(default_factory=list, init=False, repr=False)
+    links: int = field(default=0, init=False, repr=False) # absolute links left for link_pages
+    duplicate: bool = field(default=False, init=False, repr=False) # page already fetched by another node
+    selected: bool = field(default=True, init=False, repr=False) # False for nodes only kept to reach a selection
+    stale: bool = field(default=False, init=False, repr=False) # fetched or read, not rewritten yet
+    kind: Optional[Type] = field(default=None, init=False, repr=False) # fixed type, kept from the title of another locale
+    lastmod: str = field(default="", init=False, repr=False) # from a sitemap, unchanged pages are not requested
     
     def __post_init__(self):
         if not self.href:
@@ -28,9 +45,23 @@ class Child:
     def base_uri(self):
         return self.parent.base_uri()
     def add_css_uri(self, uri):
+        self.css_uris.append(uri)
         self.parent.add_css_uri(uri)
     def add_js_uri(self, uri):
+        self.js_uris.append(uri)
         self.parent.add_js_uri(uri)
+    def previous(self, url):
+        return self.parent.previous(url)
+    def mark_changed(self):
+        self.parent.mark_changed()
+    def first_visit(self, url, kind="page"):
+        return self.parent.first_visit(url, kind)
+    def report(self, event, count=1, nbytes=0, request=False):
+        self.parent.report(event, count, nbytes, request)
+    def select(self, node):
+        return self.parent.select(node)
+    def slimmer(self):
+        return self.parent.slimmer()
     def domain(self):
         return self.parent.domain()
     def get_base_url(self):
@@ -100,10 +131,19 @@ class Child:
         href = text.get("href")
         if not href:
             href = ""
-        logging.debug(f"Creating child for \"{title}\" to {href}")
+        logging.debug("Creating child for \"%s\" to %s", title, href)
         if not title:
             raise ValueError(f"json text cannot be Child node", text)
-        return Child(parent, title, href)
+        child = Child(parent, title, href)
+        if not child.apply_selection():
+            return None
+        return child
+
+    def apply_selection(self) -> bool:
+        # returns False when the source's selection excludes this node
+        match = self.select(self)
+        self.selected = match is Match.Keep
+        return match is not Match.Skip
     
     def get_contents(self, webdriver, input) -> List[Tuple[str, Union['Toc','Branch','Child']]]:
         '''
@@ -113,131 +153,219 @@ class Child:
         url+href -> output+href+toc_title.html
         returns: toc url, parent
         '''
-        logging.info(f"Accessing child \"{self.toc_title}\"")
-        tocs = set() # just paths to get future tocs from
-        if self.has_contents(input):
+        tocs = self.discover()
+        if self.prepare(input):
+            self.finish(*self.request(webdriver))
+            self.keep(input)
+        if self.stale:
+            self.rewrite()
+        return tocs
+
+    def discover(self) -> List[Tuple[str, Union['Toc','Branch','Child']]]:
+        # sub toc this node leads to, without fetching anything
+        if self.isfile():
+            return list()
+        return [(self.folder(self.base_uri()), self)] # [(toc, self), ...]
+
+    def prepare(self, input) -> bool:
+        '''
+        First half of a page fetch, run on the crawling thread.
+        Skips duplicates and reads pages kept in input.
+        returns: True when request() still has to be called
+        '''
+        logging.debug("Accessing child \"%s\"", self.toc_title)
+        if not self.selected:
+            return False
+        self.duplicate = not self.first_visit(self.url())
+        if self.duplicate:
+            logging.debug("  Already fetched for another node")
+            return False
+        prev = self.previous(self.url())
+        if prev and prev.contents and self.lastmod and prev.lastmod == self.lastmod:
+            # the sitemap says it has not changed since the previous crawl
+            self.adopt(prev)
+            self.report("fetched")
+            return False
+        if prev and prev.contents and any(prev.validator):
+            return True
+        if prev is self:
+            # kept from a reused toc without validators, nothing to revalidate
+            self.adopt(prev)
+            self.report("fetched")
+            return False
+        start = time.perf_counter()
+        if self.load(input):
             logging.debug("  Using previously downloaded files")
-            if not self.contents:
-                self.read(input)
+            self.fetch_time = time.perf_counter() - start
+            self.report("fetched", nbytes=len(self.contents))
+            self.stale = True
+            return False
+        return True
+
+    def request(self, webdriver) -> Tuple[Optional[bytes], Tuple[str, str]]:
+        # network half of a page fetch, safe to run from worker threads
+        start = time.perf_counter()
+        prev = self.previous(self.url())
+        if prev and prev.contents and any(prev.validator):
+            logging.debug("  Revalidating previous crawl")
+            result = webdriver.get_if_changed(self.url(), prev.validator)
         else:
             logging.debug("  Downloading new file")
-            self.contents = webdriver.get_text(self.url())
-        self.rewrite_html() # always rewrite, wont harm previously done files
-        if not self.isfile():
-            tocs.add( self.folder(self.base_uri()) )
-        return list(map(lambda t: (t, self), tocs)) # [(toc, self), ...]
+            result = webdriver.get_if_changed(self.url())
+        self.fetch_time = time.perf_counter() - start
+        return result
+
+    def finish(self, data, validator):
+        # last half of a page fetch, back on the crawling thread
+        prev = self.previous(self.url())
+        if data is None:
+            self.adopt(prev)
+            self.report("fetched", request=True)
+            return
+        self.contents, self.validator = data, validator
+        self.report("fetched", nbytes=len(self.contents), request=True)
+        self.stale = True
+
+    def keep(self, input):
+        # packs a page as fetched into a PageStore input, rebuilds rewrite it from there
+        if self.stale and isinstance(input, PageStore):
+            input.put(self.file(), self.contents)
+
+    def rewrite(self, result=None):
+        # result comes from rewrite_page run elsewhere, otherwise rewrite here
+        start = time.perf_counter()
+        if result is None:
+            self.rewrite_html() # always rewrite, wont harm previously done files
+            self.rewrite_time = time.perf_counter() - start
+        else:
+            self.apply(result)
+            self.rewrite_time = result.elapsed
+        self.mark_changed()
+        self.report("rewritten")
     
+    def reset(self):
+        # forget the fetched page, e.g. before fetching it in another language
+        self.contents, self.text, self.validator = b'', "", ("", "")
+        self.css_uris, self.js_uris = list(), list()
+        self.links, self.fetch_time, self.rewrite_time = 0, 0.0, 0.0
+        self.duplicate, self.stale = False, False
+
     def has_contents(self, output):
         if self.contents:
             return True
-        return os.path.exists(self.folder(output)) and os.path.exists(self.file(output))
+        if output is None:
+            return False # no local copy to read from, e.g. offline builds
+        if isinstance(output, PageStore):
+            return self.file() in output
+        return self.file(output).is_file()
+
+    def load(self, input) -> bool:
+        # reads a kept copy of the page from input, a folder or a PageStore
+        if self.contents:
+            return True
+        if isinstance(input, PageStore):
+            self.read(input) # one lookup instead of has_contents and read
+            return bool(self.contents)
+        if not self.has_contents(input):
+            return False
+        self.read(input)
+        return True
+
+    def adopt(self, prev) -> bool:
+        # reuse the already rewritten page of an unchanged node from a previous crawl
+        logging.debug("  Unchanged since previous crawl")
+        if prev is not self: # nodes of reused tocs adopt their own page
+            self.contents, self.text, self.validator = prev.contents, prev.text, prev.validator
+            self.links = prev.links
+            if not self.toc_title:
+                # sitemap nodes are rediscovered without the title their page gave them
+                self.toc_title = prev.toc_title
+                self.apply_selection()
+            self.css_uris, self.js_uris = list(prev.css_uris), list(prev.js_uris)
+        for uri in self.css_uris:
+            self.parent.add_css_uri(uri)
+        for uri in self.js_uris:
+            self.parent.add_js_uri(uri)
+        return True
 
     def rewrite_html(self):
         if not self.contents:
             raise RuntimeError("Cannot rewrite html without contents", self)
-        def remove_elements(soup):
-            # remove link to external references since we can't support it
-            for abs_href in soup.findAll("a", { "data-linktype" : "absolute-path"}):
-                abs_href.replace_with(abs_href.text)
-            # remove unsupported nav elements
-            nav_elements = [
-                ["nav"  , { "class" : "doc-outline", "role" : "navigation"}],
-                ["ul"   , { "class" : "breadcrumbs", "role" : "navigation"}],
-                ["div"  , { "class" : "sidebar", "role" : "navigation"}],
-                ["div"  , { "class" : "dropdown dropdown-full mobilenavi"}],
-                ["p"    , { "class" : "api-browser-description"}],
-                ["div"  , { "class" : "api-browser-search-field-container"}],
-                ["div"  , { "class" : "pageActions"}],
-                ["div"  , { "class" : "container footerContainer"}],
-                ["div"  , { "class" : "dropdown-container"}],
-                ["div"  , { "class" : "page-action-holder"}],
-                ["div"  , { "class" : "header-holder"}],
-                ["div"  , { "id"    : "article-header"}],
-                ["div"  , { "id"    : "user-feedback"}],
-                ["div"  , { "aria-label" : "Breadcrumb", "role" : "navigation"}],
-                ["div"  , { "data-bi-name" : "rating"}],
-                ["div"  , { "data-bi-name" : "feedback-section"}],
-                ["ul"   , { "class":"links", "data-bi-name":"footerlinks"}],
-                ["section" , { "class" : "feedback-section", "data-bi-name" : "feedback-section"}],
-                ["footer" , { "data-bi-name" : "footer", "id" : "footer"}],
-            ]
-            for nav in nav_elements:
-                nav_class, nav_attr = nav
-                
-                for nav_tag in soup.findAll(nav_class, nav_attr):
-                    _ = nav_tag.extract()
-            if soup.head:
-                for head_script in soup.head.findAll("script",{"src":True}):
-                    if head_script["src"].startswith('http'):
-                        # only want to remove externals
-                        _ = head_script.extract()
-            return soup
-        def fix_relative_links(soup):
-            for link in soup.findAll("a", { "data-linktype" : "relative-path"}):
-                href = link["href"]
-                if href.endswith("/"): # is dir point to index
-                    href = f"{href}index.html"
-                else: # is file, just add html
-                    href = f"{href}.html"
-                if href != link["href"]:
-                    link["href"] = href
-            return soup
-        def find_extra_files(soup):
-            for link in soup.findAll('a',{'rel': 'stylesheet'}):
-                self.add_css_uri(f"{self.get_theme_url(link['href'])}")
-                link['href'] = f"/_themes_/{os.path.basename(link['href'])}"
-            for link in soup.findAll('link',{'rel': 'stylesheet'}):
-                self.add_css_uri(f"{self.get_theme_url(link['href'])}")
-                link['href'] = f"/_themes_/{os.path.basename(link['href'])}"
-            for link in soup.findAll('script',{"src":True}):
-                self.add_js_uri(f"{self.get_theme_url(link['src'])}")
-                link['src'] = f"/_themes_/{os.path.basename(link['src'])}"
-            return soup
-        def insert_dash_toc(soup):
-            rec_type = quote(str(self.dash_type()))
-            name = quote(str(self.toc_title))
-            attrs = {"name": f"//apple_ref/cpp/{rec_type}/{name}", "class": "dashAnchor"}
-            tag = soup.new_tag(name="a", attrs=attrs)
-            if soup.head:
-                soup.head.insert(0, tag) # this is technically unclosed...?
-            else:
-                soup.body.insert(0, tag)
-            return soup
+        self.apply(rewrite_page(self.contents, self.rewrite_context()))
 
-        soup = bs(self.contents, 'html.parser')
-        soup = remove_elements(soup)
-        soup = fix_relative_links(soup)
-        soup = find_extra_files(soup)
-        soup = insert_dash_toc(soup)
-        self.contents = soup.prettify("utf-8")
+    def rewrite_context(self) -> 'RewriteContext':
+        slimmer = self.slimmer()
+        return RewriteContext(
+            self.toc_title,
+            str(self.dash_type()),
+            self.domain(),
+            self.get_theme_url("/"),
+            slimmer.worker() if slimmer else None,
+            "" if self.toc_title else os.path.basename(self.href.rstrip("/")),
+        )
+
+    def apply(self, result: 'RewriteResult'):
+        # takes the output of rewrite_page, wherever it ran
+        self.contents, self.text, self.links = result.contents, result.text, result.links
+        if not self.toc_title:
+            # found by a sitemap, named after the page itself
+            self.toc_title = result.title or os.path.basename(self.href.rstrip("/"))
+            self.apply_selection() # title rules could not match before
+        self.css_uris, self.js_uris = list(), list()
+        for uri in result.css_uris:
+            self.add_css_uri(uri)
+        for uri in result.js_uris:
+            self.add_js_uri(uri)
+        if result.slim:
+            self.slimmer().merge(result.slim)
+        self.stale = False
 
     def dash_type(self):
+        if self.kind:
+            return self.kind
         dtype = Type.from_str(self.toc_title)
         if not dtype:
             return self.parent.dash_type()
         return dtype
 
-    def db_insert(self, db):
-        rec_type = self.dash_type()
-        db.insert(self.toc_title, rec_type, self.file())
+    def db_insert(self, db, index=True, text=True):
+        # index and text rows can go in separately, e.g. text once rewritten
+        if not self.selected:
+            return
+        if index:
+            db.insert(self.toc_title, self.dash_type(), self.file())
+        if text:
+            db.insert_text(self.toc_title, self.file(), self.text)
 
     def write(self, output):
+        if not self.selected or (self.duplicate and not self.contents):
+            return # outside the selection or written by the node that fetched it
         if not self.contents:
             raise RuntimeError("Cannot write contents without them")
         os.makedirs(self.folder(output), exist_ok=True)
         with open(self.file(output), 'wb') as f:
                 f.write(self.contents)
+        self.report("written")
     
     def read(self, input):
-        with open(self.file(input), encoding="utf8") as f:
+        if not self.selected:
+            return
+        if isinstance(input, PageStore):
+            self.contents = input.get(self.file()) or b''
+            return
+        # kept as the raw utf-8 bytes written by rewrite_html
+        with open(self.file(input), 'rb') as f:
             self.contents = f.read()
 
     def write_tar(self, tar):
+        if not self.selected or (self.duplicate and not self.contents):
+            return
         doc_path = Path("Contents/Resources/Documents")
         if isinstance(self.contents, bytes):
             tar_write_bytes(tar, doc_path.joinpath(self.file()), self.contents)
         else:
             tar_write_str(tar, doc_path.joinpath(self.file()), self.contents)
+        self.report("written")
 
 @dataclass
 class Branch(Child):
@@ -248,8 +376,10 @@ class Branch(Child):
     
     @staticmethod
     def from_json(text, parent):
-        logging.debug(f"Creating branch for \"{text.get('toc_title')}\"")
+        logging.debug("Creating branch for \"%s\"", text.get('toc_title'))
         branch = Branch(parent, text.get("toc_title"), text.get("href"), [])
+        if not branch.apply_selection():
+            return None
         
         if "children" in text:
             for item in text["children"]:
@@ -258,7 +388,8 @@ class Branch(Child):
                     child = Branch.from_json(item, branch)
                 else:
                     child = Child.from_json(item, branch)
-                branch.children.append(child)
+                if child:
+                    branch.children.append(child)
         return branch
     
     def get_contents(self, webdriver, input) -> List[Tuple[str, Union['Toc','Branch','Child']]]:
@@ -266,23 +397,28 @@ class Branch(Child):
         Download text contents for self if href is available as a child
         and download children to output/toc_title
         '''
-        sub_tocs = list()
-        logging.info(f"Downloading branch \"{self.toc_title}\"")
-        if self.href and self.href not in [".", "./", "../"]:
-            # download branches with href like children by using tocs
-            sub_tocs.append((self.folder(self.base_uri()), self))
+        logging.debug("Downloading branch \"%s\"", self.toc_title)
+        sub_tocs = self.discover()
         # add href pathing, and get children to it
         sub_tocs.extend(__get_contents__(self.children, webdriver, input))
         return sub_tocs
-    
+
+    def discover(self) -> List[Tuple[str, Union['Toc','Branch','Child']]]:
+        # only this branch, Toc.discover walks the children
+        if self.href and self.href not in [".", "./", "../"]:
+            # download branches with href like children by using tocs
+            return [(self.folder(self.base_uri()), self)]
+        return list()
+
+    def prepare(self, input) -> bool:
+        return False # branch pages come from their own toc
+
+    # node methods below act on this branch only, Toc drives them over walk()
     def has_contents(self, output):
-        if self.href:
-            if not os.path.exists(self.folder(output)) or \
-            not os.path.exists(self.file(fooutputlder)):
-                return False
-        for child in self.children:
-            if not child.has_contents(output):
-                return False
+        if output is None:
+            return bool(self.contents) or not (self.href and self.selected)
+        if self.href and self.selected:
+            return super().has_contents(output)
         return True
     
     def toc(self, domain=""):
@@ -290,33 +426,29 @@ class Branch(Child):
             return None
         return super().toc(domain)
 
-    def db_insert(self, db):
-        rec_type = self.dash_type()
+    def db_insert(self, db, index=True, text=True):
+        if not self.selected:
+            return
         # isfile?
-        db.insert(self.toc_title, rec_type, self.file())
-        for child in self.children:
-            child.db_insert(db)
+        if index:
+            db.insert(self.toc_title, self.dash_type(), self.file())
+        if text:
+            db.insert_text(self.toc_title, self.file(), self.text)
 
     def write(self, output):
+        if not self.selected:
+            return
         if self.contents:
             super().write(output)
         os.makedirs(self.folder(output), exist_ok=True)
-        for child in self.children:
-            child.write(output)
     
     def read(self, input):
         if self.isfile():
             super().read(input)
-        idx = 0
-        while idx < len(self.children):
-            self.children[idx].read(input)
-            idx += 1
 
     def write_tar(self, tar):
         if self.isfile():
             super().write_tar(tar)
-        for child in self.children:
-            child.write_tar(tar)
 
 @dataclass
 class Metadata:
@@ -331,7 +463,7 @@ class Metadata:
         prod = text.get("ms.prod")
         title = text.get("titleSuffix")
         scope = []
-        logging.info(f"Creating metadata for \"{title}\"")
+        logging.debug("Creating metadata for \"%s\"", title)
 
         if "searchScope" in text:
             for item in text["searchScope"]:
@@ -344,29 +476,66 @@ class Toc:
     metadata: Optional['Metadata']
     contents: Optional[bytes] = field(default=b'', repr=False, init=False)
     parent: Optional[Union['DocSource', 'Toc']] = field(default=None, repr=False)
+    path: str = field(default="", init=False) # toc uri this was crawled from
+    digest: str = field(default="", init=False, repr=False) # sha1 of the toc.json
+    page: Optional['Child'] = field(default=None, init=False, repr=False) # index.html node
+    # (toc path, parent) entries this toc queued when crawled
+    sub_tocs: List[Tuple[str, Union['Branch','Child']]] = field(default_factory=list, init=False, repr=False)
     
     @staticmethod
     def from_json(text, parent=None):
-        logging.info("Toc.from_json()")
+        logging.debug("Toc.from_json()")
         items = []
         metadata = None
-        if isinstance(text, str):
+        digest = ""
+        if isinstance(text, (str, bytes)):
+            digest = Toc.digest_of(text)
             text = json.loads(text)
         if "metadata" in text:
             metadata = Metadata.from_json(text["metadata"])
         toc = Toc([], metadata, parent)
+        toc.digest = digest
         if "items" in text:
             for item in text["items"]:
                 if "children" in item:
-                    toc.items.append(Branch.from_json(item, toc))
+                    node = Branch.from_json(item, toc)
                 else:
-                    toc.items.append(Child.from_json(item, toc))
+                    node = Child.from_json(item, toc)
+                if node:
+                    toc.items.append(node)
         return toc
     
+    @staticmethod
+    def digest_of(text):
+        if isinstance(text, str):
+            text = text.encode('utf-8')
+        return hashlib.sha1(text).hexdigest()
+
+    def walk(self):
+        return walk(self.items, self)
+
+    def nodes(self):
+        # every Branch and Child in this toc, pre-order
+        for node, _, _ in self.walk():
+            yield node
+
+    def visit(self, *sinks):
+        # feed every node to each sink in a single pass
+        for node, _, _ in self.walk():
+            for sink in sinks:
+                sink(node)
+
     def get_index(self, title, webdriver, input):
         # call on root tocs to get base_uri -> index.html
         child = Child(self, title, './')
         child.get_contents(webdriver, input)
+        if child.duplicate:
+            # sources sharing base_uri each write an index, fetch it for this one too
+            child.duplicate = False
+            child.finish(*child.request(webdriver))
+            child.keep(input)
+            child.rewrite()
+        self.page = child
         self.contents = child.contents
     
     def write_index(self, output):
@@ -385,30 +554,60 @@ class Toc:
             tar_write_str(tar, index, self.contents)
 
     def get_contents(self, webdriver, input) -> List[Tuple[str, Union['Toc','Branch','Child']]]:
-        logging.info(f"Downloading toc {self.metadata.title}")
+        logging.debug("Downloading toc %s", self.path)
         sub_tocs = list()
         sub_tocs = __get_contents__(self.items, webdriver, input)
-        logging.info(f"Completed toc download for {self.metadata.title}")
+        logging.debug("Completed toc download for %s", self.path)
         return sub_tocs
     
+    def discover(self) -> List[Tuple[str, Union['Toc','Branch','Child']]]:
+        # sub tocs of every node in walk order, without fetching pages
+        sub_tocs = list()
+        toc_paths = set()
+        for node in self.nodes():
+            for toc in node.discover():
+                if toc[0] not in toc_paths:
+                    sub_tocs.append(toc)
+                    toc_paths.add(toc[0])
+        return sub_tocs
+
     def has_contents(self, output):
-        for item in self.items:
-            if not item.has_contents(output):
-                return False
-        return True
+        return all(node.has_contents(output) for node in self.nodes())
+
+    def localize(self, text):
+        '''
+        Takes toc titles from the same toc.json in another language. Nodes are
+        matched by href, so local paths stay shared between locales, and keep
+        the type their current title gives them.
+        '''
+        titles = dict()
+        stack = list(json.loads(text).get("items", []))
+        while stack:
+            item = stack.pop()
+            children = item.get("children", [])
+            key = title_key(item.get("href"), [child.get("href") for child in children])
+            if key and item.get("toc_title"):
+                titles.setdefault(key, item["toc_title"])
+            stack.extend(children)
+        nodes = list(self.nodes())
+        for node in nodes:
+            node.kind = node.dash_type()
+        for node in nodes:
+            key = title_key(node.href, [child.href for child in getattr(node, "children", [])])
+            node.toc_title = titles.get(key, node.toc_title)
+
+    def read(self, input):
+        self.visit(lambda node: node.read(input))
 
     def write(self, output):
-        for item in self.items:
-            item.write(output)
+        self.visit(lambda node: node.write(output))
 
     def db_insert(self, db):
-        for item in self.items:
-            # should this be nothing, having sqlite inside of base_path and relative internally?
-            item.db_insert(db)
+        # should this be nothing, having sqlite inside of base_path and relative internally?
+        self.visit(lambda node: node.db_insert(db))
 
     def write_tar(self, tar):
-        for item in self.items:
-            item.write_tar(tar)
+        self.visit(lambda node: node.write_tar(tar))
 
     # terminate parent calls
     def folder(self, dir):
@@ -427,7 +626,7 @@ class Toc:
         raise RuntimeError("No docsource to request base_uri from")
     def domain(self):
         if self.parent:
-            if isinstance(self.parent, Toc):
+            if isinstance(self.parent, (Toc, Branch, Child)):
                 return self.parent.domain()
             else:
                 return self.parent.domain
@@ -442,6 +641,195 @@ class Toc:
         self.parent.add_css_uri(uri)
     def add_js_uri(self, uri):
         self.parent.add_js_uri(uri)
+    def previous(self, url):
+        return self.parent.previous(url)
+    def mark_changed(self):
+        self.parent.mark_changed()
+    def first_visit(self, url, kind="page"):
+        return self.parent.first_visit(url, kind)
+    def report(self, event, count=1, nbytes=0, request=False):
+        self.parent.report(event, count, nbytes, request)
+    def select(self, node):
+        if not self.parent:
+            return Match.Keep
+        return self.parent.select(node)
+    def slimmer(self):
+        if not self.parent:
+            return None
+        return self.parent.slimmer()
+
+@dataclass
+class RewriteContext:
+    # what rewrite_page needs from a node, small enough to send to another process
+    title: str
+    dash_type: str
+    domain: str
+    theme_base: str # theme url of "/"
+    slim: Optional['Slimmer'] = None
+    name: str = "" # for pages without a toc title or a heading
+
+    def theme_url(self, href):
+        return f"{self.theme_base}{href.lstrip('/')}"
+
+@dataclass
+class RewriteResult:
+    contents: bytes = b''
+    text: str = ""
+    css_uris: List[str] = field(default_factory=list)
+    js_uris: List[str] = field(default_factory=list)
+    links: int = 0 # absolute links left for link_pages
+    slim: Optional['Slimmer'] = None # bytes saved and blocks hoisted by this page
+    elapsed: float = 0.0
+    title: str = "" # heading of the page, for nodes without a toc title
+
+def rewrite_page(contents, context: RewriteContext) -> RewriteResult:
+    '''
+    Rewrites one raw page for Dash. Pure, so it can run in a process pool:
+    everything it finds is returned instead of added to the node.
+    '''
+    from bs4 import BeautifulSoup as bs, NavigableString # only pages need bs4, load it on first rewrite
+    start = time.perf_counter()
+    result = RewriteResult()
+    def remove_elements(soup):
+        # point links outside this page tree at their online url, link_pages
+        # later swaps the ones that are part of the docset for local files
+        for abs_href in soup.findAll("a", { "data-linktype" : "absolute-path"}):
+            if not abs_href.get("href"):
+                abs_href.replace_with(abs_href.text)
+                continue
+            href = abs_href["href"]
+            if not href.startswith("/") and "://" not in href:
+                continue # already pointed at a local file when this page was first rewritten
+            abs_href["href"] = urljoin(f"https://{context.domain}/", href)
+            result.links += 1
+        # remove unsupported nav elements
+        nav_elements = [
+            ["nav"  , { "class" : "doc-outline", "role" : "navigation"}],
+            ["ul"   , { "class" : "breadcrumbs", "role" : "navigation"}],
+            ["div"  , { "class" : "sidebar", "role" : "navigation"}],
+            ["div"  , { "class" : "dropdown dropdown-full mobilenavi"}],
+            ["p"    , { "class" : "api-browser-description"}],
+            ["div"  , { "class" : "api-browser-search-field-container"}],
+            ["div"  , { "class" : "pageActions"}],
+            ["div"  , { "class" : "container footerContainer"}],
+            ["div"  , { "class" : "dropdown-container"}],
+            ["div"  , { "class" : "page-action-holder"}],
+            ["div"  , { "class" : "header-holder"}],
+            ["div"  , { "id"    : "article-header"}],
+            ["div"  , { "id"    : "user-feedback"}],
+            ["div"  , { "aria-label" : "Breadcrumb", "role" : "navigation"}],
+            ["div"  , { "data-bi-name" : "rating"}],
+            ["div"  , { "data-bi-name" : "feedback-section"}],
+            ["ul"   , { "class":"links", "data-bi-name":"footerlinks"}],
+            ["section" , { "class" : "feedback-section", "data-bi-name" : "feedback-section"}],
+            ["footer" , { "data-bi-name" : "footer", "id" : "footer"}],
+        ]
+        for nav in nav_elements:
+            nav_class, nav_attr = nav
+            
+            for nav_tag in soup.findAll(nav_class, nav_attr):
+                _ = nav_tag.extract()
+        if soup.head:
+            for head_script in soup.head.findAll("script",{"src":True}):
+                if head_script["src"].startswith('http'):
+                    # only want to remove externals
+                    _ = head_script.extract()
+        return soup
+    def slim(soup):
+        if context.slim:
+            context.slim.slim(soup)
+        return soup
+    def fix_relative_links(soup):
+        for link in soup.findAll("a", { "data-linktype" : "relative-path"}):
+            href = link["href"]
+            if href.endswith("/"): # is dir point to index
+                href = f"{href}index.html"
+            else: # is file, just add html
+                href = f"{href}.html"
+            if href != link["href"]:
+                link["href"] = href
+        return soup
+    def find_extra_files(soup):
+        for link in soup.findAll('a',{'rel': 'stylesheet'}):
+            result.css_uris.append(context.theme_url(link['href']))
+            link['href'] = f"/_themes_/{os.path.basename(link['href'])}"
+        for link in soup.findAll('link',{'rel': 'stylesheet'}):
+            if is_hoisted(link['href']) or is_bundle(link['href']):
+                continue # written from the slimmer or bundle_assets, pages read back from disk already link it
+            result.css_uris.append(context.theme_url(link['href']))
+            link['href'] = f"/_themes_/{os.path.basename(link['href'])}"
+        for link in soup.findAll('script',{"src":True}):
+            if is_bundle(link['src']):
+                continue
+            result.js_uris.append(context.theme_url(link['src']))
+            link['src'] = f"/_themes_/{os.path.basename(link['src'])}"
+        return soup
+    def find_title(soup):
+        if context.title:
+            return soup
+        heading = soup.find("h1") or soup.find("title")
+        if heading:
+            result.title = " ".join(heading.get_text().split()).split(" | ")[0]
+        result.title = result.title or context.name
+        return soup
+    def insert_dash_toc(soup):
+        title = context.title or result.title
+        dtype = context.dash_type
+        if not context.title:
+            dtype = str(Type.from_str(title)) # the node only gets its title from here
+        rec_type = quote(dtype)
+        name = quote(str(title))
+        attrs = {"name": f"//apple_ref/cpp/{rec_type}/{name}", "class": "dashAnchor"}
+        tag = soup.new_tag(name="a", attrs=attrs)
+        if soup.head:
+            soup.head.insert(0, tag) # this is technically unclosed...?
+        else:
+            soup.body.insert(0, tag)
+        return soup
+    def extract_text(soup):
+        # index only the article when present, nav has already been removed
+        main = soup.find("main") or soup.body or soup
+        strings = [
+            text for text in main.findAll(string=True)
+            if type(text) is NavigableString and text.parent.name not in ["script", "style"]
+        ]
+        result.text = " ".join(" ".join(strings).split())
+        return soup
+
+    soup = bs(contents, 'html.parser')
+    soup = find_title(soup)
+    soup = remove_elements(soup)
+    soup = fix_relative_links(soup)
+    soup = find_extra_files(soup)
+    soup = slim(soup) # hoisted styles are already local, keep them out of find_extra_files
+    soup = insert_dash_toc(soup)
+    soup = extract_text(soup)
+    result.contents = soup.prettify("utf-8")
+    result.slim = context.slim
+    result.elapsed = time.perf_counter() - start
+    return result
+
+def title_key(href, child_hrefs):
+    # branches without a page are known by their first child with one
+    if href:
+        return href
+    for child_href in child_hrefs:
+        if child_href:
+            return f"#{child_href}"
+    return None
+
+def walk(items, parent=None):
+    '''
+    Iterative pre-order walk over Branch and Child nodes, safe for any toc depth.
+    yields: (node, depth, parent) with depth 0 for items
+    '''
+    stack = [(item, 0, parent) for item in reversed(items)]
+    while stack:
+        node, depth, parent = stack.pop()
+        yield node, depth, parent
+        children = getattr(node, "children", None)
+        if children:
+            stack.extend((child, depth + 1, node) for child in reversed(children))
 
 def __get_contents__(items, webdriver, input):
     sub_tocs = list()
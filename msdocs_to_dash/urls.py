@@ -0,0 +1,76 @@
+#!env python3
+
+from dataclasses import dataclass, field
+from collections import Counter
+from typing import Dict, Set
+from urllib.parse import urlsplit, urljoin
+import posixpath
+import re
+
+LOCALE = re.compile(r"^[a-z]{2}-[a-z]{2,4}$", re.IGNORECASE)
+ABSOLUTE_HREF = re.compile(rb'href="(https?://[^"#]*)(#[^"]*)?"')
+
+def canonical_url(url, base=""):
+    '''
+    Normalizes a url so every spelling of one page gives the same key.
+    Relative urls are resolved against base, ./ and ../ are collapsed and the
+    scheme, locale, fragment, case and trailing / are dropped. Query parameters
+    are kept, sorted, since they select views such as ?view=windowsserver2019-ps
+    https://learn.microsoft.com/en-us/windows/win32/api/_ad/ -> learn.microsoft.com/windows/win32/api/_ad
+    '''
+    if base:
+        url = urljoin(base, url)
+    parts = urlsplit(url)
+    path = posixpath.normpath(parts.path or "/")
+    segments = [seg for seg in path.split("/") if seg and seg != "."]
+    if segments and LOCALE.match(segments[0]):
+        segments = segments[1:]
+    url = "/".join([parts.netloc.lower()] + segments).lower()
+    if parts.query:
+        url = f"{url}?{'&'.join(sorted(parts.query.split('&')))}"
+    return url
+
+@dataclass
+class Visited:
+    '''
+    Canonical urls requested during one build, counting every request made
+    and every duplicate avoided by kind (toc, page, ...).
+    '''
+    seen: Set[str] = field(default_factory=set, repr=False)
+    fetched: Counter = field(default_factory=Counter)
+    duplicates: Counter = field(default_factory=Counter)
+
+    def visit(self, url, kind="page") -> bool:
+        # True the first time a url is seen, so the caller should fetch it
+        key = canonical_url(url)
+        if key in self.seen:
+            self.duplicates[kind] += 1
+            return False
+        self.seen.add(key)
+        self.fetched[kind] += 1
+        return True
+
+    def __contains__(self, url):
+        return canonical_url(url) in self.seen
+
+    def mark(self, url):
+        # record a url as handled without a request, e.g. reused from a previous crawl
+        self.seen.add(canonical_url(url))
+
+    def report(self):
+        kinds = sorted(set(self.fetched) | set(self.duplicates))
+        return ", ".join(f"{kind}: {self.fetched[kind]} fetched {self.duplicates[kind]} duplicates avoided" for kind in kinds)
+
+def link_page(contents: bytes, page_path: str, index: Dict[str, str]) -> bytes:
+    '''
+    Points absolute links at local files when the target is part of the docset.
+    index maps canonical_url -> local path relative to the Documents folder,
+    anything not in the index keeps its online url.
+    '''
+    prefix = "../" * page_path.count("/") # from the page folder back to Documents
+    def replace(match):
+        local = index.get(canonical_url(match.group(1).decode('utf-8')))
+        if local is None:
+            return match.group(0)
+        return b'href="' + f"{prefix}{local}".encode('utf-8') + (match.group(2) or b'') + b'"'
+    return ABSOLUTE_HREF.sub(replace, contents)
@@ -1,81 +1,212 @@
 #!env python3
 
 from dataclasses import dataclass, field
-from typing import Any
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from typing import Any, List, Optional, Tuple
 
 import logging
 import os
 import requests
+import threading
 import time
 import urllib
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
-from requests.exceptions import ConnectionError
+from requests.exceptions import ConnectionError, Timeout
 
-from selenium import webdriver
-from selenium.webdriver import Chrome
-from selenium.webdriver.chrome.options import Options
+BUCKETS = 18 # log2 buckets from 1ms, the last one holds anything above 65s
+HEDGE_SAMPLES = 20 # responses needed before the observed p95 is trusted
+
+@dataclass
+class Latency:
+    '''
+    Histogram of request durations in log2 buckets, bucket i holds requests
+    that took less than 2**i ms. Feeds the hedge delay and is reported after
+    the fetch so deadlines can be tuned.
+    '''
+    buckets: List[int] = field(default_factory=lambda: [0] * BUCKETS)
+    count: int = 0
+    errors: int = 0 # timeouts and connection errors
+    hedged: int = 0 # duplicate requests fired past the hedge delay
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    def add(self, seconds):
+        ms = seconds * 1000
+        index = 0
+        while index < BUCKETS - 1 and ms >= 2 ** index:
+            index += 1
+        with self._lock:
+            self.buckets[index] += 1
+            self.count += 1
+
+    def error(self):
+        with self._lock:
+            self.errors += 1
+
+    def hedge(self):
+        with self._lock:
+            self.hedged += 1
+
+    def quantile(self, q) -> Optional[float]:
+        # upper bound in seconds of the bucket holding the q quantile
+        if not self.count:
+            return None
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= q * self.count:
+                return 2 ** index / 1000
+        return 2 ** (BUCKETS - 1) / 1000
+
+    def report(self) -> str:
+        lines = [f"{self.count} requests, {self.errors} errors, {self.hedged} hedged, p50 <{self.quantile(.5)}s p95 <{self.quantile(.95)}s p99 <{self.quantile(.99)}s"]
+        width = max(self.buckets) or 1
+        for index, count in enumerate(self.buckets):
+            if count:
+                lines.append(f"<{2 ** index:6d}ms {count:8d} " + "#" * max(1, 40 * count // width))
+        return "\n".join(lines)
 
 @dataclass
 class WebDriver:
-    options: 'Options' = field(init=False, repr=False)
-    driver: 'Chrome' = field(init=False, repr=False)
+    '''
+    connect_timeout and read_timeout bound each attempt, budget bounds every
+    attempt at one url together. With hedge, a request still running past the
+    observed p95 (or hedge_after seconds) gets a duplicate and the first
+    response wins.
+    '''
+    connect_timeout: float = 5.0
+    read_timeout: float = 30.0
+    budget: float = 120.0
+    hedge: bool = False
+    hedge_after: Optional[float] = None
+    latency: Latency = field(default_factory=Latency, repr=False)
+    options: 'Options' = field(default=None, init=False, repr=False)
+    driver: 'Chrome' = field(default=None, init=False, repr=False) # started by the first get_url_page
     session: 'Session' = field(init=False, repr=False)
+    _hedges: ThreadPoolExecutor = field(default=None, init=False, repr=False)
 
     def __post_init__(self):
         logging.info("Initalizing WebDriver")
-        self.options = Options()
-        self.options.add_argument("--headless")
-        self.options.add_argument("--window-size=1920x1080")   
-        self.driver = webdriver.Chrome(options=self.options)
         self.session = requests.Session()
         retries = Retry(total=5, backoff_factor=1, status_forcelist=[ 502, 503, 504 ])
         self.session.mount('http://', HTTPAdapter(max_retries=retries))
 
-    def quit():
+    def chrome(self) -> 'Chrome':
+        # selenium and Chrome are only needed for javascript pages, start them on demand
+        if self.driver is None:
+            from selenium import webdriver
+            from selenium.webdriver.chrome.options import Options
+            logging.info("Starting Chrome")
+            self.options = Options()
+            self.options.add_argument("--headless")
+            self.options.add_argument("--window-size=1920x1080")
+            self.driver = webdriver.Chrome(options=self.options)
+        return self.driver
+
+    def quit(self):
         logging.info("Closing WebDriver")
-        return self.driver.quit()
+        if self.driver:
+            self.driver.quit()
+            self.driver = None
+        if self._hedges:
+            self._hedges.shutdown(wait=False)
+            self._hedges = None
 
     def get_url_page(self, url):
         """ retrieve the full html content of a page after Javascript execution """
-        logging.debug(f"Chrome request for \"{url}\"")
+        logging.debug("Chrome request for \"%s\"", url)
         index_html = None
         try:
-            self.driver.get(url)
+            self.chrome().get(url)
             index_html = self.driver.page_source
         except (ConnectionResetError, urllib.error.URLError) as e:
-            self.driver.quit()
+            self.quit()
             time.sleep(2)
-            self.driver = webdriver.Chrome(options=self.options)
             index_html = None
         # try a second time, and raise error if fail
         if not index_html:
-            self.driver.get(url)
+            self.chrome().get(url)
             index_html = self.driver.page_source
 
         return index_html
 
-    def get_binary(self, url, output=None) -> bytes:
-        logging.debug(f"Binary request for \"{url}\"")
-        r = None
-        while True:
+    def hedge_delay(self) -> Optional[float]:
+        if not self.hedge:
+            return None
+        if self.hedge_after is not None:
+            return self.hedge_after
+        if self.latency.count < HEDGE_SAMPLES:
+            return None
+        return self.latency.quantile(.95)
+
+    def timed(self, url, timeout, **kwargs) -> requests.Response:
+        start = time.perf_counter()
+        try:
+            return self.session.get(url, timeout=(min(self.connect_timeout, timeout), timeout), **kwargs)
+        finally:
+            # timeouts count too, or the p95 behind the hedge delay comes out too low
+            self.latency.add(time.perf_counter() - start)
+
+    def hedged(self, url, timeout, **kwargs) -> requests.Response:
+        delay = self.hedge_delay()
+        if delay is None or delay >= timeout:
+            return self.timed(url, timeout, **kwargs)
+        if self._hedges is None:
+            self._hedges = ThreadPoolExecutor(32, thread_name_prefix="hedge")
+        started = threading.Event()
+        def attempt():
+            started.set()
+            return self.timed(url, timeout, **kwargs)
+        first = self._hedges.submit(attempt)
+        started.wait() # time spent queued behind other requests is not slowness
+        if wait([first], delay).done:
+            return first.result()
+        logging.debug("Hedging request for \"%s\" after %.3fs", url, delay)
+        self.latency.hedge()
+        second = self._hedges.submit(self.timed, url, timeout - delay, **kwargs)
+        error = None
+        for future in as_completed([first, second]):
             try:
-                r = self.session.get(url)
-            except ConnectionError:
-                logging.error("caught ConnectionError, retrying...")
-                time.sleep(2)
-            else:
-                break
-        return r.content
-    
-    def get_text(self, url, params=None) -> str:
-        logging.debug(f"Text request for \"{url}\"")
+                return future.result() # the slower one finishes on its own
+            except (ConnectionError, Timeout) as e:
+                error = e
+        raise error
+
+    def get(self, url, **kwargs) -> requests.Response:
+        # retries until a response arrives or the budget for url is spent
+        deadline = time.monotonic() + self.budget
         while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise Timeout(f"No response within {self.budget}s", url)
             try:
-                r = self.session.get(url, data = params)
-            except ConnectionError:
-                logging.error("caught ConnectionError, retrying...")
-                time.sleep(2)
-            else:
-                break
-        return r.text
+                return self.hedged(url, min(self.read_timeout, remaining), **kwargs)
+            except (ConnectionError, Timeout) as e:
+                self.latency.error()
+                logging.error("caught %s for %s, retrying...", type(e).__name__, url)
+                time.sleep(max(0, min(2, deadline - time.monotonic())))
+
+    def get_binary(self, url, output=None) -> bytes:
+        logging.debug("Binary request for \"%s\"", url)
+        return self.get(url).content
+
+    def get_if_changed(self, url, validator=("", "")) -> Tuple[Optional[bytes], Tuple[str, str]]:
+        '''
+        Conditional request using a previous (etag, last-modified) validator.
+        returns: (None, validator) when unchanged, otherwise (content, new validator)
+        '''
+        logging.debug("Conditional request for \"%s\"", url)
+        etag, modified = validator
+        headers = dict()
+        if etag:
+            headers["If-None-Match"] = etag
+        if modified:
+            headers["If-Modified-Since"] = modified
+        r = self.get(url, headers=headers)
+        if r.status_code == 304:
+            return None, validator
+        return r.content, (r.headers.get("ETag", ""), r.headers.get("Last-Modified", ""))
+
+    def get_text(self, url, params=None) -> str:
+        logging.debug("Text request for \"%s\"", url)
+        return self.get(url, data = params).text
@@ -0,0 +1,38 @@
+#!env python3
+
+from msdocs_to_dash.webdriver import WebDriver
+from msdocs_to_dash.assets import minify_css, bundle, link_bundle
+
+def test_minify_css():
+    css = b'/* header */\na  b ,\n c {\n  color : red;\n  content: "a ; b";\n}\n'
+    assert minify_css(css) == b'a b,c{color : red;content:"a ; b"}'
+
+def test_bundle():
+    files = [("a.js", b"one()"), ("1ds.min.js", b"track()"), ("empty.js", b""), ("a.js", b"one()")]
+    data, bundled, dropped = bundle(files, ["*1ds*"], b";")
+    assert data == b"one()"
+    assert bundled == ["a.js"]
+    assert dropped == ["1ds.min.js", "empty.js"]
+
+def test_link_bundle():
+    page = (b'<head>\n  <link href="/_themes_/a.css" rel="stylesheet"/>\n'
+            b'  <link href="/_themes_/b.css" rel="stylesheet"/>\n'
+            b'  <script src="/_themes_/1ds.js">\n  </script>\n</head>')
+    page = link_bundle(page, "css", ["a.css", "b.css"], [], "bundle.css")
+    page = link_bundle(page, "js", [], ["1ds.js"], "bundle.js")
+    assert page == b'<head>\n<link href="/_themes_/bundle.css" rel="stylesheet"/>\n</head>'
+    # already bundled pages are left alone
+    assert link_bundle(page, "css", ["a.css"], [], "bundle.css") == page
+
+def test_docset_bundle_assets(root_toc, webserver, css_ok):
+    ds = root_toc.parent.parent
+    ds.get_contents(WebDriver(), "")
+    ds.get_themes(WebDriver())
+    ds.bundle_assets()
+    assert [str(path) for path, _ in ds._css_files] == ["Contents/Resources/Documents/_themes_/bundle.css"]
+    assert ds._css_files[0][1] == minify_css(css_ok.encode('utf-8'))
+    assert ds.sources[0]._css_files == []
+    for page in ds.sources[0].pages():
+        assert b'/_themes_/bundle.css' in page.contents
+        assert b'/_themes_/file.css' not in page.contents
+    assert ds.sources[0].index.contents == ds.sources[0].index.page.contents
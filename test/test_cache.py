@@ -0,0 +1,90 @@
+#!env python3
+
+import pytest
+from copy import deepcopy
+
+from msdocs_to_dash.webdriver import WebDriver
+from msdocs_to_dash.cache import DirCache, RecordingDriver, OfflineDriver, PageStore
+
+def test_dir_cache(tmp_path):
+    cache = DirCache(tmp_path)
+    cache.put("https://learn.microsoft.com/en-us/a/", b"page", ("etag", ""))
+    cache.flush()
+    cache = DirCache(tmp_path)
+    assert cache.get("https://learn.microsoft.com/A") == b"page"
+    assert cache.validator("https://learn.microsoft.com/a/") == ("etag", "")
+    assert cache.get("https://learn.microsoft.com/b") is None
+
+def test_offline_rebuild(root_toc, webserver, tmp_path):
+    ds = root_toc.parent.parent
+    offline = deepcopy(ds)
+    cache = DirCache(tmp_path.joinpath("_cache_"))
+    with pytest.raises(RuntimeError):
+        OfflineDriver(cache) # nothing recorded yet
+    driver = RecordingDriver(WebDriver(), cache)
+    ds.get_contents(driver, None)
+    ds.get_themes(driver)
+    cache.flush()
+
+    webserver.calls.reset()
+    driver = OfflineDriver(DirCache(cache.path))
+    offline.get_contents(driver, None)
+    offline.get_themes(driver)
+    driver.check()
+    assert len(webserver.calls) == 0
+    pages = [page.contents for page in ds.sources[0].pages()]
+    assert [page.contents for page in offline.sources[0].pages()] == pages
+    assert offline._ico == ds._ico
+    assert offline.sources[0]._css_files == ds.sources[0]._css_files
+
+def test_offline_missing(root_toc, webserver, tmp_path):
+    ds = root_toc.parent.parent
+    offline = deepcopy(ds)
+    cache = DirCache(tmp_path)
+    driver = RecordingDriver(WebDriver(), cache)
+    ds.get_contents(driver, None)
+    del cache._index["learn.microsoft.com/windows/win32/api/adsprop/toc.json"]
+    del cache._index["learn.microsoft.com/windows/win32/api/_ad"]
+    cache.flush()
+    driver = OfflineDriver(DirCache(tmp_path))
+    offline.get_contents(driver, None)
+    with pytest.raises(RuntimeError) as error:
+        driver.check()
+    assert error.value.args[1] == [
+        "https://learn.microsoft.com/en-us/windows/win32/api/_ad/",
+        "https://learn.microsoft.com/en-us/windows/win32/api/adsprop/toc.json",
+    ]
+
+def test_page_store(tmp_path):
+    store = PageStore(tmp_path.joinpath("pages.db"), compress=6)
+    store.put("_ad/index.html", b"<html>" * 100)
+    store.close()
+    store = PageStore(tmp_path.joinpath("pages.db"))
+    assert store.get("_ad/index.html") == b"<html>" * 100
+    assert "_ad/index.html" in store
+    assert store.get("adsprop/index.html") is None
+    assert len(store) == 1
+
+def test_page_store_input(root_toc, webserver, tmp_path):
+    ds = root_toc.parent.parent
+    again = deepcopy(ds)
+    store = PageStore(tmp_path.joinpath("pages.db"), compress=1)
+    ds.get_contents(WebDriver(), store)
+    store.commit()
+    webserver.calls.reset()
+    again.get_contents(WebDriver(), store)
+    pages = [call.request.url for call in webserver.calls if not call.request.url.endswith("toc.json")]
+    assert pages == [] # every page comes from the store
+    # stored pages are raw, so the rebuild rewrites them exactly once
+    assert [page.contents for page in again.sources[0].pages()] == [page.contents for page in ds.sources[0].pages()]
+    assert all(page.contents.count(b"dashAnchor") == 1 for page in again.sources[0].pages())
+
+def test_dir_cache_threads(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+    cache = DirCache(tmp_path)
+    urls = [f"https://learn.microsoft.com/en-us/{idx}" for idx in range(200)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda url: cache.put(url, b"same body"), urls))
+    cache.flush()
+    assert len(DirCache(tmp_path)) == 200
+    assert not list(tmp_path.rglob("*.tmp"))
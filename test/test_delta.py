@@ -0,0 +1,58 @@
+#!env python3
+
+import pytest
+import json
+from pathlib import Path
+from tarfile import TarFile
+
+from msdocs_to_dash.sqlite import SqLiteDb, Type
+from msdocs_to_dash.tar import tar_write_bytes
+from msdocs_to_dash.delta import make_delta, apply_delta, Snapshot, DATABASE
+
+def make_tar(path, pages, rows):
+    db_path = Path(path).with_suffix(".dsidx")
+    db = SqLiteDb.new(db_path, fts=True)
+    for name, rec_type, page in rows:
+        db.insert(name, rec_type, page)
+        db.insert_text(name, page, pages[page].decode())
+    db.close()
+    with TarFile.open(str(path), "w:gz") as tar:
+        for name, data in pages.items():
+            tar_write_bytes(tar, f"Contents/Resources/Documents/{name}", data)
+        tar.add(str(db_path), DATABASE)
+    return path
+
+@pytest.fixture
+def old_tar(tmp_path):
+    return make_tar(tmp_path.joinpath("old.docset.tar"),
+        {"a.html": b"alpha", "b.html": b"beta", "c.html": b"gamma"},
+        [("A", Type.Function, "a.html"), ("B", Type.Function, "b.html"), ("C", Type.Macro, "c.html")])
+
+@pytest.fixture
+def new_tar(tmp_path):
+    return make_tar(tmp_path.joinpath("new.docset.tar"),
+        {"a.html": b"alpha", "b.html": b"beta two", "d.html": b"delta"},
+        [("A", Type.Function, "a.html"), ("B", Type.Function, "b.html"), ("D", Type.Struct, "d.html")])
+
+def test_make_delta(old_tar, new_tar, tmp_path):
+    delta = make_delta(old_tar, new_tar, tmp_path.joinpath("update.delta.tar"))
+    with TarFile.open(delta) as tf:
+        manifest = json.load(tf.extractfile("delta.json"))
+        assert sorted(tf.getnames()) == [
+            "delta.json",
+            "files/Contents/Resources/Documents/b.html",
+            "files/Contents/Resources/Documents/d.html",
+        ]
+    assert manifest["removed"] == ["Contents/Resources/Documents/c.html"]
+    assert manifest["rows_added"] == [["D", "Struct", "d.html"]]
+    assert manifest["rows_removed"] == [["C", "Macro", "c.html"]]
+
+def test_apply_delta(old_tar, new_tar, tmp_path):
+    delta = make_delta(old_tar, new_tar, tmp_path.joinpath("update.delta.tar"))
+    result = apply_delta(old_tar, delta, tmp_path.joinpath("result.docset.tar"))
+    assert Snapshot.from_tar(result, tmp_path).checksum() == Snapshot.from_tar(new_tar, tmp_path).checksum()
+
+def test_apply_delta_wrong_base(new_tar, old_tar, tmp_path):
+    delta = make_delta(old_tar, new_tar, tmp_path.joinpath("update.delta.tar"))
+    with pytest.raises(RuntimeError):
+        apply_delta(new_tar, delta, tmp_path.joinpath("result.docset.tar"))
@@ -2,6 +2,7 @@
 
 import logging
 import pytest
+import responses
 import os
 from copy import deepcopy
 from tarfile import TarFile
@@ -9,6 +10,9 @@ from pathlib import Path
 
 from msdocs_to_dash.webdriver import WebDriver
 from msdocs_to_dash.docset import DocSource, DocSet
+from msdocs_to_dash.filters import Selection
+from msdocs_to_dash.sqlite import SqLiteDb
+from msdocs_to_dash.slim import Slimmer
 
 def test_docsource_with_toc():
     ds = DocSource("Win32k", "windows/win32/api", "windows/different/toc.json")
@@ -37,7 +41,7 @@ def test_docsource_get_css(root_toc, webserver, css_ok):
     ds.get_contents(WebDriver(), "")
     assert ds._css_files == ['https://learn.microsoft.com/test/blah/file.css']
     ds.get_themes(WebDriver())
-    assert ds._css_files == [(Path('Contents/Resources/Documents/_themes_/file.css'), css_ok)]
+    assert ds._css_files == [(Path('Contents/Resources/Documents/_themes_/file.css'), css_ok.encode('utf-8'))]
     
 def test_docsource_write(root_toc, webserver, tmp_path):
     # docsource forces packaging paths
@@ -118,4 +122,155 @@ def test_docset_make_package(root_toc, webserver, tmp_path):
             "Contents/Resources/Documents/adsprop/index.html",
             "Contents/Resources/Documents/adsprop/nf-adsprop-adspropcheckifwritable.html",
             "Contents/Resources/Documents/_themes_/file.css"
-        ].sort()
\ No newline at end of file
+        ].sort()
+
+def test_docset_refresh(root_toc, webserver, html_ok):
+    def conditional(request):
+        if request.headers.get("If-None-Match") == '"v1"':
+            return (304, {}, "")
+        return (200, {"ETag": '"v1"'}, html_ok)
+    url = "https://learn.microsoft.com/en-us/windows/win32/api"
+    for entry in ["", "_ad/", "adsprop/", "adsprop/nf-adsprop-adspropcheckifwritable"]:
+        webserver.remove(responses.GET, f'{url}/{entry}')
+        webserver.add_callback(responses.GET, f'{url}/{entry}', callback=conditional)
+    ds = root_toc.parent.parent
+    ds.get_contents(WebDriver(), "")
+    assert ds.changed() == True
+    ds.get_contents(WebDriver(), "")
+    assert ds.changed() == False
+    assert ds.sources[0]._css_files == ['https://learn.microsoft.com/test/blah/file.css']
+    assert len(ds.sources[0]._tocs) == 3
+
+def test_docsource_prune(root_toc, webserver):
+    ds = root_toc.parent
+    ds.get_contents(WebDriver(), "")
+    webserver.calls.reset()
+    ds.get_contents(WebDriver(), "")
+    urls = [call.request.url for call in webserver.calls]
+    assert ds._reused == 2
+    assert len(ds._tocs) == 3
+    assert "https://learn.microsoft.com/en-us/windows/win32/api/_ad/toc.json" in urls
+    assert "https://learn.microsoft.com/en-us/windows/win32/api/adsprop/toc.json" not in urls
+    assert "https://learn.microsoft.com/en-us/windows/win32/api/adsprop/" not in urls
+    assert ds._css_files == ['https://learn.microsoft.com/test/blah/file.css']
+
+def test_docsource_prune_revalidates(root_toc, webserver, html_ok):
+    url = "https://learn.microsoft.com/en-us/windows/win32/api/adsprop/nf-adsprop-adspropcheckifwritable"
+    pages = {'"v1"': html_ok}
+    def conditional(request):
+        etag = sorted(pages)[-1]
+        if request.headers.get("If-None-Match") == etag:
+            return (304, {}, "")
+        return (200, {"ETag": etag}, pages[etag])
+    webserver.remove(responses.GET, url)
+    webserver.add_callback(responses.GET, url, callback=conditional)
+    ds = root_toc.parent
+    ds.get_contents(WebDriver(), "")
+    pages['"v2"'] = html_ok.replace("exists", "edited")
+    ds.get_contents(WebDriver(), "")
+    assert ds._reused == 2
+    page = [p for p in ds.pages() if p.url() == url][0]
+    assert b"edited" in page.contents
+    assert page.validator[0] == '"v2"'
+    assert ds.changed() == True
+
+def test_docset_link_pages(root_toc, webserver):
+    url = "https://learn.microsoft.com/en-us/windows/win32/api"
+    webserver.replace(responses.GET, f"{url}/adsprop/nf-adsprop-adspropcheckifwritable",
+        body='<html><body><a data-linktype="absolute-path" href="/en-us/windows/win32/api/_ad/">AD</a>'
+             '<a data-linktype="absolute-path" href="/en-us/windows/win32/api/missing">gone</a></body></html>')
+    ds = root_toc.parent.parent
+    ds.get_contents(WebDriver(), "")
+    page = [p for p in ds.sources[0].pages() if p.isfile()][0]
+    assert b'href="../_ad/index.html"' in page.contents
+    assert b'href="https://learn.microsoft.com/en-us/windows/win32/api/missing"' in page.contents
+
+def test_docset_link_index(root_toc, webserver):
+    url = "https://learn.microsoft.com/en-us/windows/win32/api"
+    webserver.replace(responses.GET, f"{url}/",
+        body='<html><body><a data-linktype="absolute-path" href="/en-us/windows/win32/api/_ad/">AD</a></body></html>')
+    ds = root_toc.parent.parent
+    ds.get_contents(WebDriver(), "")
+    source = ds.sources[0]
+    assert b'href="_ad/index.html"' in source.index.page.contents
+    assert source.index.contents == source.index.page.contents
+
+def test_docset_visited(root_toc, webserver):
+    ds = root_toc.parent.parent
+    ds.get_contents(WebDriver(), "")
+    urls = [call.request.url for call in webserver.calls]
+    assert len(urls) == len(set(urls))
+    assert ds._visited.fetched == {"toc": 3, "page": 4}
+    assert ds._visited.duplicates["page"] == 2
+
+def test_docsource_selection(root_toc, webserver, tmp_path):
+    ds = root_toc.parent
+    ds.selection = Selection(exclude=["adsprop"])
+    ds.get_contents(WebDriver(), "")
+    urls = [call.request.url for call in webserver.calls]
+    assert not [url for url in urls if "adsprop" in url]
+    db = SqLiteDb.new(tmp_path.joinpath("docSet.dsidx"))
+    ds.make_database(db)
+    db.cur.execute("SELECT path FROM searchIndex")
+    assert not [path for path, in db.cur.fetchall() if "adsprop" in path]
+
+
+def test_docset_dry_run(root_toc, webserver):
+    ds = root_toc.parent.parent
+    ds.discover(WebDriver(), "")
+    urls = [call.request.url for call in webserver.calls]
+    # only toc.json files and the index page are requested
+    assert [url for url in urls if not url.endswith("toc.json")] == ["https://learn.microsoft.com/en-us/windows/win32/api/"]
+    assert ds.dry_run() == {"tocs": 3, "reused_tocs": 0, "nodes": 10, "pages": 3, "bytes": 3 * 60 * 1024}
+    manifest = ds.sources[0].manifest()
+    assert [page["path"] for page in manifest] == ["_ad/index.html", "adsprop/index.html", "adsprop/nf-adsprop-adspropcheckifwritable.html"]
+    ds.fetch(WebDriver(), "")
+    assert len(list(ds.sources[0].pages())) == 4
+
+
+def test_docsource_rewrite_processes(root_toc, webserver):
+    ds = root_toc.parent.parent
+    pooled = deepcopy(ds)
+    pooled.sources[0].processes = 2
+    pooled.slim = Slimmer()
+    ds.slim = Slimmer()
+    ds.get_contents(WebDriver(), "")
+    pooled.get_contents(WebDriver(), "")
+    assert [page.contents for page in pooled.sources[0].pages()] == [page.contents for page in ds.sources[0].pages()]
+    assert [page.text for page in pooled.sources[0].pages()] == [page.text for page in ds.sources[0].pages()]
+    assert pooled.sources[0]._css_files == ds.sources[0]._css_files
+    assert pooled.slim.saved == ds.slim.saved
+
+
+def test_docset_live_index(root_toc, webserver, tmp_path):
+    ds = root_toc.parent.parent
+    ds.fts = True
+    post = deepcopy(ds)
+    writer = ds.start_index(tmp_path.joinpath("live"))
+    ds.get_contents(WebDriver(), "")
+    assert ds.writer is None and writer.closed()
+    assert ds.database() == ds.database_path(tmp_path.joinpath("live"))
+    post.get_contents(WebDriver(), "")
+    post.make_database(tmp_path.joinpath("post"))
+    rows = list()
+    for output in ["live", "post"]:
+        db = SqLiteDb.open(ds.database_path(tmp_path.joinpath(output)))
+        db.cur.execute("SELECT name, type, path FROM searchIndex ORDER BY id")
+        index = db.cur.fetchall()
+        db.cur.execute("SELECT name, path, body FROM searchText ORDER BY path")
+        rows.append((index, db.cur.fetchall()))
+        db.close()
+    assert rows[0] == rows[1]
+    assert rows[0][1]
+
+def test_docset_shared_index(webserver, tmp_path):
+    # like the Powershell docset, two sources below one base_uri
+    ds = DocSet("Windows Desktop Api", "Win32k", [
+        DocSource("Win32k", "windows/win32/api"),
+        DocSource("Win32k2019", "windows/win32/api", "windows/win32/api/toc.json?view=win2019"),
+    ])
+    ds.get_contents(WebDriver(), "")
+    ds.get_themes(WebDriver())
+    assert all(source.index.contents for source in ds.sources)
+    ds.write_contents(tmp_path)
+    assert os.path.exists(f"{tmp_path}/Contents/Resources/Documents/index.html")
@@ -0,0 +1,71 @@
+#!env python3
+
+import io
+import pytest
+import responses
+from dataclasses import dataclass, field
+from tarfile import TarFile
+
+from msdocs_to_dash.downloader import MsWatcher, MsDownloader
+from msdocs_to_dash.docset import DocSet, DocSource
+from msdocs_to_dash.sqlite import SqLiteDb
+from msdocs_to_dash.progress import Progress
+
+@dataclass
+class Source:
+    title: str
+
+@dataclass
+class Refresher:
+    source: Source
+    calls: int = 0
+    def refresh(self):
+        self.calls += 1
+        return True
+
+def test_watcher_schedule():
+    fast, slow = Refresher(Source("fast")), Refresher(Source("slow"))
+    watcher = MsWatcher([fast, slow], interval=60, schedules={"fast": 0})
+    watcher.run(cycles=5)
+    assert slow.calls == 1
+    assert fast.calls == 4
+
+def test_watcher_survives_errors():
+    class Broken(Refresher):
+        def refresh(self):
+            self.calls += 1
+            raise RuntimeError("offline")
+    broken = Broken(Source("broken"))
+    watcher = MsWatcher([broken], interval=0)
+    watcher.run(cycles=2)
+    assert broken.calls == 2
+
+def test_build_locales(webserver, root_json, ad_json, adsprop_json, html_ok, tmp_path):
+    url = "https://learn.microsoft.com/de-de/windows/win32/api"
+    for entry in ["", "_ad/", "adsprop/", "adsprop/nf-adsprop-adspropcheckifwritable"]:
+        webserver.add(responses.GET, f"{url}/{entry}", body=html_ok.replace("exists", "vorhanden"))
+    german = lambda text: text.replace("Active Directory Domain Services", "Active Directory-Domänendienste")
+    webserver.add(responses.GET, f"{url}/toc.json", body=german(root_json))
+    webserver.add(responses.GET, f"{url}/_ad/toc.json", body=german(ad_json))
+    webserver.add(responses.GET, f"{url}/adsprop/toc.json", body=adsprop_json)
+    docset = DocSet("Windows Desktop Api", "Win32k", DocSource("Win32k", "windows/win32/api"))
+    progress = Progress(stream=io.StringIO(), interval=3600, machine=True)
+    downloader = MsDownloader(docset, str(tmp_path), record=False, bundle=False, progress=progress)
+    outputs = downloader.build_locales(["de-de", "en-us"])
+    # both locales count to the one status line, started once for the build
+    data = progress.snapshot()
+    assert data["discovered"] == data["fetched"] == 9
+    assert sorted(outputs) == ["de-de", "en-us"]
+    requests = [call.request.url for call in webserver.calls]
+    # the structure is discovered once, each locale fetches every toc once for its titles
+    assert requests.count("https://learn.microsoft.com/en-us/windows/win32/api/_ad/toc.json") == 2
+    assert requests.count(f"{url}/_ad/toc.json") == 1
+    tar_path = tmp_path.joinpath("de-de", "Windows Desktop Api (de-de).docset.tar")
+    with TarFile.open(tar_path) as tar:
+        page = tar.extractfile("Contents/Resources/Documents/_ad/index.html").read()
+        assert b"vorhanden" in page
+    db = SqLiteDb.open(tmp_path.joinpath("de-de", "Contents/Resources/docSet.dsidx"))
+    db.cur.execute("SELECT name, path FROM searchIndex")
+    rows = db.cur.fetchall()
+    assert ("Active Directory-Domänendienste", "_ad/index.html") in rows
+    assert tmp_path.joinpath("en-us", "Windows Desktop Api (en-us).docset.tar").exists()
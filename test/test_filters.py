@@ -0,0 +1,41 @@
+#!env python3
+
+import pytest
+
+from msdocs_to_dash.toc import Toc
+from msdocs_to_dash.docset import DocSource
+from msdocs_to_dash.filters import Selection, Match, node_path, depth
+
+def titles(toc):
+    return [node.toc_title for node in toc.nodes()]
+
+def test_node_path(base_toc):
+    branch = base_toc.items[1]
+    assert node_path(base_toc.items[0]) == "_input_touchinjection"
+    assert node_path(branch.children[0]) == "adsprop"
+    assert node_path(branch.children[1]) == "adsprop/nf-adsprop-adspropcheckifwritable"
+    assert depth(branch) == 0
+    assert depth(branch.children[0]) == 1
+
+def test_selection_exclude(base_toc_path, base_toc_json):
+    ds = DocSource("Win32k", base_toc_path, selection=Selection(exclude=["adsprop"]))
+    toc = Toc.from_json(base_toc_json, ds)
+    assert titles(toc) == ["Touch Injection", "Active Directory Domain Services"]
+
+def test_selection_include(base_toc_path, base_toc_json):
+    ds = DocSource("Win32k", base_toc_path, selection=Selection(include=["adsprop/"]))
+    toc = Toc.from_json(base_toc_json, ds)
+    # the branch is only walked to reach its selected children
+    assert titles(toc) == ["Active Directory Domain Services", "Overview", "ADsPropCheckIfWritable function"]
+    assert [node.selected for node in toc.nodes()] == [False, True, True]
+
+def test_selection_title_depth(base_toc_path, base_toc_json):
+    ds = DocSource("Win32k", base_toc_path, selection=Selection(include_titles=["writable"]))
+    toc = Toc.from_json(base_toc_json, ds)
+    # folders stay to crawl their sub tocs, other pages are dropped
+    assert len(titles(toc)) == 4
+    assert [node.toc_title for node in toc.nodes() if node.selected] == ["ADsPropCheckIfWritable function"]
+    ds.selection = Selection(max_depth=0, exclude_urls=["*/_input_*"])
+    toc = Toc.from_json(base_toc_json, ds)
+    assert titles(toc) == ["Active Directory Domain Services"]
+    assert ds.select(toc.items[0]) is Match.Keep
@@ -0,0 +1,26 @@
+#!env python3
+
+import subprocess
+import sys
+
+HEAVY = ["bs4", "selenium", "requests", "regex"]
+
+def loaded(modules):
+    # heavy modules pulled in by importing modules in a fresh interpreter
+    code = (
+        "import sys\n"
+        f"import {modules}\n"
+        f"print(','.join(m for m in {HEAVY!r} if m in sys.modules))\n"
+    )
+    return subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout.strip()
+
+def test_import_is_light():
+    # the index and tar modules must not pull in the crawler dependencies
+    assert loaded("msdocs_to_dash, msdocs_to_dash.sqlite, msdocs_to_dash.tar, msdocs_to_dash.delta") == ""
+    # toc filters still match titles with regex, pages are parsed on first rewrite
+    assert loaded("msdocs_to_dash.docset") == "regex"
+
+def test_lazy_submodules():
+    import msdocs_to_dash
+    assert msdocs_to_dash.urls.canonical_url("https://learn.microsoft.com/A/") == "learn.microsoft.com/a"
+    assert "toc" in dir(msdocs_to_dash)
@@ -0,0 +1,28 @@
+#!env python3
+
+import pytest
+import os
+import pstats
+
+from msdocs_to_dash.webdriver import WebDriver
+from msdocs_to_dash.profiler import Profiler
+
+def test_stage(tmp_path):
+    prof = Profiler(tmp_path)
+    with prof.stage("sum"):
+        sum(range(1000))
+    assert "sum" in prof.stages
+    assert os.path.exists(f"{tmp_path}/profile/sum.pstats")
+    pstats.Stats(f"{tmp_path}/profile/sum.pstats")
+
+def test_report(root_toc, webserver, tmp_path):
+    ds = root_toc.parent.parent
+    ds.get_contents(WebDriver(), "")
+    prof = Profiler(tmp_path, top=2)
+    nodes = Profiler.nodes(ds)
+    assert len(set(n.url for n in nodes)) == 3
+    assert all(n.size > 0 for n in nodes)
+    assert len(prof.slowest(nodes)) == 2
+    report = prof.write_report(ds)
+    assert report.startswith(f"{len(nodes)} pages")
+    assert os.path.exists(f"{tmp_path}/profile/report.txt")
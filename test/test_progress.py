@@ -0,0 +1,52 @@
+#!env python3
+
+import io
+import json
+
+from msdocs_to_dash.progress import Progress
+
+def test_progress_machine():
+    stream = io.StringIO()
+    progress = Progress(stream=stream, interval=0, machine=True)
+    progress.add("discovered", 4)
+    progress.add("fetched", nbytes=100, request=True)
+    progress.set_queue(2)
+    progress.finish()
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 4
+    data = json.loads(lines[-1])
+    assert data["discovered"] == 4
+    assert data["fetched"] == 1
+    assert data["queue"] == 2
+    assert data["eta"] is not None
+    assert progress.requests == 1
+    assert progress.bytes == 100
+
+def test_progress_throttled():
+    stream = io.StringIO()
+    progress = Progress(stream=stream, interval=3600)
+    progress.add("discovered")
+    progress.add("discovered")
+    assert stream.getvalue().count("\r") == 1
+    progress.finish()
+    last = stream.getvalue().split("\r")[-1]
+    assert last.startswith("discovered 2 fetched 0 rewritten 0 written 0")
+    assert last.endswith("queue 0 eta ?\n")
+
+def test_progress_deepcopy(docset):
+    # shard workers build from deep copies of the docset
+    from copy import deepcopy
+    docset.progress = Progress(stream=io.StringIO())
+    assert deepcopy(docset).progress is docset.progress
+
+def test_progress_per_build(root_toc, webserver):
+    from msdocs_to_dash.webdriver import WebDriver
+    ds = root_toc.parent.parent
+    ds.progress = Progress(stream=io.StringIO(), interval=3600, machine=True)
+    ds.get_contents(WebDriver(), "")
+    first, requests = ds.progress.snapshot(), ds.progress.requests
+    ds.get_contents(WebDriver(), "")
+    data = ds.progress.snapshot()
+    assert data["discovered"] == data["fetched"] == first["fetched"] == 4
+    assert data["eta"] == 0
+    assert ds.progress.requests <= requests
@@ -0,0 +1,49 @@
+#!env python3
+
+import os
+import plistlib
+import pytest
+
+from msdocs_to_dash.webdriver import WebDriver
+from msdocs_to_dash.docset import DocSet, DocSource
+from msdocs_to_dash.sqlite import SqLiteDb
+from msdocs_to_dash.publish import Publisher
+
+def test_publish_snapshots(root_toc, webserver, tmp_path):
+    ds = root_toc.parent.parent
+    ds.publisher = Publisher(tmp_path, pages=1)
+    published = list()
+    publish = ds.publisher.publish
+    def check(docset, webdriver):
+        root = publish(docset, webdriver)
+        # every indexed page of a snapshot is there
+        db = SqLiteDb.open(docset.database_path(root))
+        db.cur.execute("SELECT path FROM searchIndex")
+        paths = [path for path, in db.cur.fetchall()]
+        db.close()
+        assert all(docset.documents_path(root).joinpath(path).exists() for path in paths)
+        published.append(len(paths))
+        return root
+    ds.publisher.publish = check
+    ds.get_contents(WebDriver(), "")
+    root = tmp_path.joinpath("Windows Desktop Api.partial.docset")
+    assert root.is_symlink()
+    assert published == sorted(published) and len(published) == 4 # one per page, then the final one
+    assert published[-1] > published[0]
+    assert ds.documents_path(root).joinpath("index.html").exists()
+    assert ds.theme_file_path("file.css", root).exists()
+    with open(ds.plist_path(root), 'rb') as f:
+        assert plistlib.load(f)["CFBundleName"] == "Windows Desktop Api"
+    assert not os.path.lexists(f"{root}.tmp")
+
+def test_priority(root_toc, webserver):
+    ds = root_toc.parent.parent
+    ds.sources[0].priority = ["adsprop"]
+    ds.sources[0].workers = 1
+    ds.get_contents(WebDriver(), "")
+    pages = [call.request.url for call in webserver.calls if not call.request.url.endswith("toc.json")]
+    assert pages[1:] == [
+        "https://learn.microsoft.com/en-us/windows/win32/api/adsprop/",
+        "https://learn.microsoft.com/en-us/windows/win32/api/adsprop/nf-adsprop-adspropcheckifwritable",
+        "https://learn.microsoft.com/en-us/windows/win32/api/_ad/",
+    ]
@@ -0,0 +1,85 @@
+#!env python3
+
+from copy import deepcopy
+from tarfile import TarFile
+import os
+import pytest
+import socket
+import time
+
+from msdocs_to_dash.webdriver import WebDriver
+from msdocs_to_dash.sqlite import SqLiteDb
+from msdocs_to_dash.shard import Shard, ShardQueue, shard_key, work, merge, configured_docset
+
+def test_shard_key():
+    assert shard_key("windows/win32/api/fileapi/nf-fileapi-createfilew", "windows/win32/api") == "fileapi"
+    assert shard_key("/windows/win32/api/", "windows/win32/api") == ""
+    assert shard_key("_AD/") == "_ad"
+    shards = [Shard(index, 3) for index in range(3)]
+    assert [shard.owns("fileapi") for shard in shards].count(True) == 1
+    assert shards[0].owns("")
+
+def test_shard_queue(tmp_path):
+    queue = ShardQueue(tmp_path, 2)
+    first, second = queue.claim(), queue.claim()
+    assert (first.index, second.index) == (0, 1)
+    assert queue.claim() is None
+    queue.finish(first)
+    assert queue.missing() == [1]
+
+def test_shard_queue_reclaim(tmp_path):
+    queue = ShardQueue(tmp_path, 3)
+    queue.finish(queue.claim())
+    queue.claim()
+    # a worker on this host that is gone, and one on another host long ago
+    queue.marker(0, "claim").write_text(f"{socket.gethostname()} 999999999\n")
+    queue.marker(1, "claim").write_text(f"{socket.gethostname()} 999999999\n")
+    queue.marker(2, "claim").write_text("elsewhere 1\n")
+    assert queue.claim().index == 1
+    assert queue.claim() is None
+    os.utime(queue.marker(2, "claim"), (0, 0))
+    assert queue.claim().index == 2
+    assert queue.marker(2, "claim").read_text() == f"{socket.gethostname()} {os.getpid()}\n"
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["shard-0000.claim", "shard-0000.done", "shard-0001.claim", "shard-0002.claim"]
+
+def test_shard_queue_heartbeat(tmp_path):
+    queue = ShardQueue(tmp_path, 1, expire=0.2)
+    shard = queue.claim()
+    queue.marker(0, "claim").write_text("elsewhere 1\n") # as if claimed by another host
+    with queue.heartbeat(shard):
+        time.sleep(0.5)
+        assert not queue.is_stale(0)
+    time.sleep(0.3)
+    assert queue.is_stale(0)
+
+def test_configured_docset():
+    docset = configured_docset("Windows Desktop Api")
+    assert docset.sources[0].base_uri == "windows/win32/api"
+    with pytest.raises(ValueError):
+        configured_docset("Unknown")
+
+def rows(path):
+    db = SqLiteDb.open(path)
+    db.cur.execute("SELECT name, type, path FROM searchIndex")
+    return sorted(db.cur.fetchall())
+
+def test_shard_merge(root_toc, webserver, tmp_path):
+    ds = root_toc.parent.parent
+    single = deepcopy(ds)
+    single.get_contents(WebDriver(), "")
+    single.get_themes(WebDriver())
+    single.write_contents(tmp_path.joinpath("single"))
+    single.make_package(tmp_path.joinpath("single"))
+
+    queue = ShardQueue(tmp_path.joinpath("queue"), 3)
+    work(ds, queue, WebDriver())
+    tar_path = merge(ds, queue, tmp_path.joinpath("merged"))
+    database = "Contents/Resources/docSet.dsidx"
+    assert rows(tmp_path.joinpath("merged", database)) == rows(tmp_path.joinpath("single", database))
+    with TarFile.open(tar_path) as merged, \
+    TarFile.open(tmp_path.joinpath("single", "Windows Desktop Api.docset.tar")) as built:
+        assert sorted(merged.getnames()) == sorted(built.getnames())
+    # every shard only wrote its own subtrees
+    pages = [sorted(str(p.relative_to(queue.shard_path(i))) for p in queue.shard_path(i).rglob("*.html")) for i in range(3)]
+    owned = [page for shard in pages for page in shard if not page.endswith("Documents/index.html")]
+    assert len(owned) == len(set(owned)) == 3
@@ -0,0 +1,50 @@
+#!env python3
+
+import json
+import pytest
+from tarfile import TarFile
+
+from msdocs_to_dash.webdriver import WebDriver
+from msdocs_to_dash.sqlite import SqLiteDb
+from msdocs_to_dash.sinks import Sink, DashTar, ZealDocset, NdjsonExport
+
+def test_emit(root_toc, webserver, tmp_path):
+    ds = root_toc.parent.parent
+    ds.get_contents(WebDriver(), "")
+    ds.get_themes(WebDriver())
+    webserver.calls.reset()
+    tar_path, zeal_path, ndjson_path = ds.emit(DashTar(tmp_path), ZealDocset(tmp_path), NdjsonExport(tmp_path, html=True))
+    assert len(webserver.calls) == 0
+    with TarFile.open(tar_path) as tf:
+        names = sorted(tf.getnames())
+    assert names == sorted([
+        "icon.png",
+        "Contents/Info.plist",
+        "Contents/Resources/docSet.dsidx",
+        "Contents/Resources/Documents/index.html",
+        "Contents/Resources/Documents/_ad/index.html",
+        "Contents/Resources/Documents/adsprop/index.html",
+        "Contents/Resources/Documents/adsprop/nf-adsprop-adspropcheckifwritable.html",
+        "Contents/Resources/Documents/_themes_/file.css",
+    ])
+    assert zeal_path == tmp_path.joinpath("Windows Desktop Api.docset")
+    zeal_files = sorted(str(path.relative_to(zeal_path)) for path in zeal_path.rglob("*") if path.is_file())
+    assert zeal_files == names
+    db = SqLiteDb.open(zeal_path.joinpath("Contents/Resources/docSet.dsidx"))
+    db.cur.execute("SELECT path FROM searchIndex")
+    assert ("_ad/index.html",) in db.cur.fetchall()
+    with open(ndjson_path) as f:
+        records = [json.loads(line) for line in f]
+    assert records[0]["path"] == "index.html"
+    pages = {record["path"]: record for record in records}
+    assert pages["_ad/index.html"]["title"] == "Active Directory Domain Services"
+    assert pages["_ad/index.html"]["url"] == "https://learn.microsoft.com/en-us/windows/win32/api/_ad/"
+    assert pages["_ad/index.html"]["text"] == "exists"
+    assert "dashAnchor" in pages["_ad/index.html"]["html"]
+
+def test_sink_interface():
+    class Partial(Sink):
+        def add(self, node):
+            pass
+    with pytest.raises(TypeError):
+        Partial() # close is what every sink has to provide
@@ -0,0 +1,86 @@
+#!env python3
+
+import gzip
+import pytest
+
+from msdocs_to_dash.webdriver import WebDriver
+from msdocs_to_dash.docset import DocSet, DocSource
+from msdocs_to_dash.sitemap import Sitemap
+from msdocs_to_dash.filters import Selection
+from msdocs_to_dash.sqlite import SqLiteDb
+
+NS = 'xmlns="http://www.sitemaps.org/schemas/sitemap/0.9"'
+BASE = "https://learn.microsoft.com/en-us/windows/win32/api"
+
+@pytest.fixture
+def sitemap(tmp_path):
+    # local stand-in for the site's sitemap index and one of its sitemaps
+    api = tmp_path.joinpath("api.xml.gz")
+    with gzip.open(api, 'wb') as f:
+        f.write(f'''<?xml version="1.0" encoding="UTF-8"?>
+        <urlset {NS}>
+            <url><loc>{BASE}/</loc><lastmod>2024-01-01</lastmod></url>
+            <url><loc>{BASE}/_ad/</loc><lastmod>2024-01-01</lastmod></url>
+            <url><loc>{BASE}/adsprop/</loc><lastmod>2024-01-02</lastmod></url>
+            <url><loc>{BASE}/adsprop/nf-adsprop-adspropcheckifwritable</loc><lastmod>2024-01-03</lastmod></url>
+            <url><loc>https://learn.microsoft.com/en-us/windows/win32/apiother/</loc></url>
+        </urlset>'''.encode('utf-8'))
+    index = tmp_path.joinpath("sitemapindex.xml")
+    index.write_text(f'''<?xml version="1.0" encoding="UTF-8"?>
+        <sitemapindex {NS}>
+            <sitemap><loc>{api}</loc></sitemap>
+            <sitemap><loc>{tmp_path.joinpath("dotnet.xml")}</loc></sitemap>
+        </sitemapindex>''')
+    return Sitemap(str(index), sitemaps=["*/api.xml.gz"])
+
+def test_sitemap_pages(sitemap):
+    pages = list(sitemap.pages(None, BASE))
+    assert pages == [
+        (f"{BASE}/", "2024-01-01"),
+        (f"{BASE}/_ad/", "2024-01-01"),
+        (f"{BASE}/adsprop/", "2024-01-02"),
+        (f"{BASE}/adsprop/nf-adsprop-adspropcheckifwritable", "2024-01-03"),
+    ]
+
+def test_sitemap_discover(webserver, sitemap):
+    ds = DocSet("Windows Desktop Api", "Win32k", DocSource("Win32k", "windows/win32/api", sitemap=sitemap))
+    ds.get_contents(WebDriver(), "")
+    urls = [call.request.url for call in webserver.calls]
+    assert [url for url in urls if url.endswith("toc.json")] == [f"{BASE}/toc.json"]
+    pages = {str(page.file()): page for page in ds.sources[0].pages()}
+    assert sorted(pages) == ["_ad/index.html", "adsprop/index.html", "adsprop/nf-adsprop-adspropcheckifwritable.html", "index.html"]
+    # named after the page when the root toc does not list it
+    assert pages["adsprop/nf-adsprop-adspropcheckifwritable.html"].toc_title == "nf-adsprop-adspropcheckifwritable"
+    assert pages["_ad/index.html"].toc_title == "Active Directory Domain Services"
+    webserver.calls.reset()
+    ds.get_contents(WebDriver(), "")
+    urls = [call.request.url for call in webserver.calls]
+    # unchanged lastmod, not requested again
+    assert f"{BASE}/adsprop/nf-adsprop-adspropcheckifwritable" not in urls
+    assert f"{BASE}/_ad/" not in urls
+    assert len(list(ds.sources[0].pages())) == 4
+
+def test_page_title(base_toc):
+    child = base_toc.items[0]
+    child.toc_title = ""
+    child.contents = b"<html><head><title>CreateFileW function (fileapi.h) | Microsoft Learn</title></head><body>x</body></html>"
+    child.rewrite_html()
+    assert child.toc_title == "CreateFileW function (fileapi.h)"
+    assert b"//apple_ref/cpp/Function/CreateFileW" in child.contents
+
+def test_sitemap_live_index(webserver, sitemap, tmp_path):
+    ds = DocSet("Windows Desktop Api", "Win32k", DocSource("Win32k", "windows/win32/api", sitemap=sitemap))
+    ds.start_index(tmp_path)
+    ds.get_contents(WebDriver(), "")
+    db = SqLiteDb.open(ds.database())
+    db.cur.execute("SELECT name, path FROM searchIndex")
+    rows = db.cur.fetchall()
+    assert ("nf-adsprop-adspropcheckifwritable", "adsprop/nf-adsprop-adspropcheckifwritable.html") in rows
+    assert not [name for name, _ in rows if not name]
+
+def test_sitemap_title_selection(webserver, sitemap):
+    selection = Selection(include_titles=["adspropcheckifwritable"])
+    ds = DocSet("Windows Desktop Api", "Win32k", DocSource("Win32k", "windows/win32/api", sitemap=sitemap, selection=selection))
+    ds.get_contents(WebDriver(), "")
+    pages = [str(page.file()) for page in ds.sources[0].pages() if page.selected]
+    assert pages == ["index.html", "adsprop/nf-adsprop-adspropcheckifwritable.html"]
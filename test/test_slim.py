@@ -0,0 +1,65 @@
+#!env python3
+
+import copy
+import pytest
+from bs4 import BeautifulSoup as bs
+
+from msdocs_to_dash.webdriver import WebDriver
+from msdocs_to_dash.slim import Slimmer, hoisted_name, RULES
+
+STYLE = ".note { color: red; }" * 20
+
+def page():
+    return bs(
+        '<html><head><script type="application/ld+json">{"a": 1}</script>'
+        '<script>var config = {};</script><script src="/_themes_/a.js"></script>'
+        f'<style>{STYLE}</style><style>p {{}}</style></head>'
+        '<body><div data-bi-name="body" data-bi-area="x">text</div>'
+        '<div hidden>gone</div><span style="display: none">gone</span>'
+        '<section id="user-feedback">rate</section></body></html>', 'html.parser')
+
+def test_slimmer():
+    slimmer = Slimmer()
+    html = str(slimmer.slim(page()))
+    assert "ld+json" not in html and "data-bi" not in html and "rate" not in html
+    # page content and scripts are kept by default
+    assert "config" in html and "gone" in html and STYLE in html
+
+def test_slimmer_all_rules():
+    slimmer = Slimmer(rules=RULES)
+    html = str(slimmer.slim(page()))
+    assert "ld+json" not in html and "config" not in html
+    assert '<script src="/_themes_/a.js"></script>' in html
+    assert "data-bi" not in html and "gone" not in html and "rate" not in html
+    # a block only seen on one page stays inline
+    assert STYLE in html and not slimmer.blocks
+    # a second page with the same block shares the file
+    html = str(slimmer.slim(page()))
+    assert "<style>p {}</style>" in html
+    assert f'href="/_themes_/{hoisted_name(next(iter(slimmer.blocks)))}"' in html
+    assert all(slimmer.saved[rule] > 0 for rule in slimmer.rules)
+    assert len(slimmer.blocks) == 1
+    assert slimmer.files("_themes_")[0][1] == STYLE.encode('utf-8')
+
+def test_slimmer_rules():
+    slimmer = Slimmer(rules=["data_bi"])
+    html = str(slimmer.slim(page()))
+    assert "data-bi" not in html and "ld+json" in html
+    assert list(slimmer.saved) == ["data_bi"]
+    with pytest.raises(ValueError):
+        Slimmer(rules=["everything"])
+    assert copy.deepcopy(slimmer).saved == slimmer.saved
+
+def test_docset_slim(root_toc, webserver, html_ok):
+    ds = root_toc.parent.parent
+    ds.slim = Slimmer(rules=["hoist_styles"], hoist_bytes=1)
+    for page in ["_ad/", "adsprop/"]:
+        webserver.replace("GET", f"https://learn.microsoft.com/en-us/windows/win32/api/{page}",
+            body=html_ok.replace("<body>", f"<body><style>{STYLE}</style>"))
+    ds.get_contents(WebDriver(), "")
+    ds.get_themes(WebDriver())
+    assert ds._css_files[-1][1] == STYLE.encode('utf-8')
+    # hoisted files are never requested as remote themes
+    assert not [call for call in webserver.calls if "inline-" in call.request.url]
+    assert not [path for path, _ in ds.sources[0]._css_files if "inline-" in str(path)]
+    assert "hoist_styles" in ds.slim.report()
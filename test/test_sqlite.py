@@ -1,9 +1,12 @@
 #!env python3
 
 import logging
+import multiprocessing
+import pickle
 import pytest
+import threading
 
-from msdocs_to_dash.sqlite import Type
+from msdocs_to_dash.sqlite import SqLiteDb, IndexWriter, Type
 
 def test_type():
     assert str(Type.Plugin) == "Plugin"
@@ -12,4 +15,71 @@ def test_type():
 
 def test_default_type():
     assert Type.from_str("Active Directory Domain Services") == Type.Category
-    assert Type.from_str("adsprop.h header") == Type.Library
\ No newline at end of file
+    assert Type.from_str("adsprop.h header") == Type.Library
+
+def test_fts(tmp_path):
+    db = SqLiteDb.new(tmp_path.joinpath("docSet.dsidx"), fts=True)
+    db.insert("CreateFileW function", Type.Function, "fileapi/nf-fileapi-createfilew.html")
+    db.insert_text("CreateFileW function", "fileapi/nf-fileapi-createfilew.html", "Creates or opens a file or I/O device.")
+    db.insert_text("ReadFile function", "fileapi/nf-fileapi-readfile.html", "Reads data from the specified file.")
+    assert db.search_text("device") == [("CreateFileW function", "fileapi/nf-fileapi-createfilew.html")]
+    db.close()
+    db = SqLiteDb.open(tmp_path.joinpath("docSet.dsidx"))
+    assert db.fts == True
+    assert len(db.search_text("file")) == 2
+    db.insert_text("ReadFile function", "fileapi/nf-fileapi-readfile.html", "Reads data again.")
+    assert db.search_text("again") == []
+    db.close()
+
+def test_no_fts(tmp_path):
+    db = SqLiteDb.new(tmp_path.joinpath("docSet.dsidx"))
+    db.insert_text("ReadFile function", "fileapi/nf-fileapi-readfile.html", "Reads data.")
+    db.close()
+    assert SqLiteDb.open(tmp_path.joinpath("docSet.dsidx")).fts == False
+
+def produce(writer, prefix, count):
+    for idx in range(count):
+        writer.insert(f"{prefix} {idx} function", Type.Function, f"{prefix}/{idx}.html")
+        writer.insert_text(f"{prefix} {idx} function", f"{prefix}/{idx}.html", f"body of {prefix} {idx}")
+
+def test_index_writer_threads(tmp_path):
+    writer = IndexWriter(tmp_path.joinpath("docSet.dsidx"), fts=True, batch=50, maxsize=10)
+    threads = [threading.Thread(target=produce, args=(writer, f"t{idx}", 100)) for idx in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    writer.close()
+    assert writer.rows == 800
+    assert writer.commits >= 8
+    db = SqLiteDb.open(tmp_path.joinpath("docSet.dsidx"))
+    db.cur.execute("SELECT COUNT(*) FROM searchIndex")
+    assert db.cur.fetchone()[0] == 400
+    assert db.search_text("t3")[0][0].startswith("t3")
+    db.close()
+
+def test_index_writer_processes(tmp_path):
+    writer = IndexWriter(tmp_path.joinpath("docSet.dsidx"), processes=True)
+    workers = [multiprocessing.Process(target=produce, args=(writer, f"p{idx}", 20)) for idx in range(2)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    writer.close()
+    db = SqLiteDb.open(tmp_path.joinpath("docSet.dsidx"))
+    db.cur.execute("SELECT path FROM searchIndex WHERE name = 'p1 19 function'")
+    assert db.cur.fetchone() == ("p1/19.html",)
+    db.close()
+
+def test_index_writer_pickle(tmp_path):
+    writer = IndexWriter(tmp_path.joinpath("docSet.dsidx"), processes=True)
+    with pytest.raises(RuntimeError):
+        pickle.dumps(writer) # only through Process arguments
+    writer.close()
+
+def test_index_writer_error(tmp_path):
+    writer = IndexWriter(tmp_path.joinpath("docSet.dsidx"))
+    writer._queue.put(("index", "too", "few"))
+    writer.insert("after", Type.Function, "after.html")
+    with pytest.raises(RuntimeError):
+        writer.close()
@@ -60,4 +60,70 @@ def test_write(root_toc, webserver, tmp_path):
 def test_write_tar(root_toc, webserver, tarfile):
     urls = root_toc.get_contents(WebDriver(), "")
     root_toc.write_tar(tarfile)
-    assert tarfile.getnames() == ["Contents/Resources/Documents/_ad/index.html"]
\ No newline at end of file
+    assert tarfile.getnames() == ["Contents/Resources/Documents/_ad/index.html"]
+
+def test_rewrite_text(base_toc, html_ok):
+    child = base_toc.items[1].children[1]
+    child.contents = html_ok
+    child.rewrite_html()
+    assert child.text == "exists"
+
+def test_rewrite_bundled(base_toc):
+    child = base_toc.items[1].children[1]
+    child.contents = (b'<html><head><link href="/_themes_/bundle.css" rel="stylesheet"/>'
+                      b'<script src="/_themes_/bundle.js"></script></head><body>x</body></html>')
+    child.rewrite_html()
+    assert child.css_uris == [] and child.js_uris == []
+    assert b'href="/_themes_/bundle.css"' in child.contents
+
+def test_rewrite_absolute_link(base_toc):
+    child = base_toc.items[1].children[1]
+    child.contents = b'<html><body><a data-linktype="absolute-path" href="/windows/win32/api/_ad/">AD</a></body></html>'
+    child.rewrite_html()
+    assert child.links == 1
+    assert b'href="https://learn.microsoft.com/windows/win32/api/_ad/"' in child.contents
+    # pages read back from input were linked locally, rewriting again keeps that
+    child.contents = b'<html><body><a data-linktype="absolute-path" href="../_ad/index.html">AD</a></body></html>'
+    child.rewrite_html()
+    assert child.links == 0
+    assert b'href="../_ad/index.html"' in child.contents
+
+def test_walk(base_toc):
+    visits = [(node.toc_title, depth, parent) for node, depth, parent in base_toc.walk()]
+    assert visits == [
+        ("Touch Injection", 0, base_toc),
+        ("Active Directory Domain Services", 0, base_toc),
+        ("Overview", 1, base_toc.items[1]),
+        ("ADsPropCheckIfWritable function", 1, base_toc.items[1]),
+    ]
+
+def test_walk_deep(docsource):
+    toc = Toc.from_json({"items": []}, docsource)
+    branch = toc
+    # build the nesting by hand, Branch.from_json itself is recursive
+    for depth in range(5000):
+        child = Branch(branch, f"level {depth}", "", [])
+        (branch.items if branch is toc else branch.children).append(child)
+        branch = child
+    assert max(depth for _, depth, _ in toc.walk()) == 4999
+
+def test_visit(base_toc):
+    titles, types = [], []
+    base_toc.visit(lambda node: titles.append(node.toc_title), lambda node: types.append(node.dash_type()))
+    assert len(titles) == len(types) == 4
+
+def test_toc_localize(base_toc):
+    function = base_toc.items[1].children[1]
+    kind = function.dash_type() # from the english title
+    base_toc.localize(b'''{"items": [
+        {"href": "_input_touchinjection/", "toc_title": "Toucheingabe"},
+        {"href": "_ad/", "toc_title": "Active Directory-Dom\\u00e4nendienste", "children": [
+            {"href": "/windows/win32/api/adsprop/nf-adsprop-adspropcheckifwritable", "toc_title": "ADsPropCheckIfWritable-Funktion"}
+        ]}
+    ]}''')
+    assert base_toc.items[0].toc_title == "Toucheingabe"
+    assert base_toc.items[1].toc_title == "Active Directory-Domänendienste"
+    assert base_toc.items[1].children[0].toc_title == "Overview" # missing from the localized toc
+    assert function.toc_title == "ADsPropCheckIfWritable-Funktion"
+    assert function.dash_type() == kind
+    assert function.file() == Path("adsprop/nf-adsprop-adspropcheckifwritable.html")
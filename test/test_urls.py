@@ -0,0 +1,40 @@
+#!env python3
+
+import pytest
+
+from msdocs_to_dash.urls import canonical_url, link_page, Visited
+
+@pytest.mark.parametrize("url", [
+    "https://learn.microsoft.com/en-us/windows/win32/api/_ad/",
+    "https://learn.microsoft.com/en-us/windows/win32/api/_ad",
+    "https://Learn.Microsoft.com/windows/win32/api/_ad/#remarks",
+    "https://learn.microsoft.com/en-us/windows/win32/api/adsprop/../_ad/./",
+])
+def test_canonical_url(url):
+    assert canonical_url(url) == "learn.microsoft.com/windows/win32/api/_ad"
+
+def test_canonical_url_relative():
+    base = "https://learn.microsoft.com/en-us/windows/win32/api/adsprop/"
+    assert canonical_url("../_ad/", base) == "learn.microsoft.com/windows/win32/api/_ad"
+    assert canonical_url("/windows/win32/api/_ad", base) == "learn.microsoft.com/windows/win32/api/_ad"
+
+def test_link_page():
+    index = {"learn.microsoft.com/windows/win32/api/_ad": "_ad/index.html"}
+    html = (b'<a href="https://learn.microsoft.com/en-us/windows/win32/api/_ad/#overview">AD</a>'
+            b'<a href="https://learn.microsoft.com/en-us/windows/win32/api/other">other</a>')
+    assert link_page(html, "adsprop/index.html", index) == (
+        b'<a href="../_ad/index.html#overview">AD</a>'
+        b'<a href="https://learn.microsoft.com/en-us/windows/win32/api/other">other</a>')
+
+def test_canonical_url_query():
+    assert canonical_url("https://learn.microsoft.com/en-us/powershell/module/?view=ps&a=1") == \
+        "learn.microsoft.com/powershell/module?a=1&view=ps"
+
+def test_visited():
+    visited = Visited()
+    assert visited.visit("https://learn.microsoft.com/en-us/windows/win32/api/toc.json", "toc") == True
+    assert visited.visit("https://learn.microsoft.com/en-us/windows/win32/api/./toc.json", "toc") == False
+    assert visited.visit("https://learn.microsoft.com/en-us/windows/win32/api/_ad/") == True
+    assert visited.visit("https://learn.microsoft.com/en-us/windows/win32/api/adsprop/../_ad") == False
+    assert visited.fetched == {"toc": 1, "page": 1}
+    assert visited.duplicates == {"toc": 1, "page": 1}
@@ -0,0 +1,74 @@
+#!env python3
+
+import pytest
+import responses
+import time
+from concurrent.futures import ThreadPoolExecutor
+from requests.exceptions import ConnectionError, Timeout
+
+from msdocs_to_dash.webdriver import WebDriver, Latency
+
+URL = "https://learn.microsoft.com/en-us/slow"
+
+def test_latency_histogram():
+    latency = Latency()
+    for ms in [0.5, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 900]:
+        latency.add(ms / 1000)
+    assert latency.count == 20
+    assert latency.buckets[0] == 1
+    assert latency.quantile(.5) == 0.004
+    assert latency.quantile(.99) == 1.024
+    assert latency.report().startswith("20 requests, 0 errors, 0 hedged")
+
+def test_budget():
+    driver = WebDriver(budget=0.2)
+    with responses.RequestsMock() as r:
+        r.add(responses.GET, URL, body=ConnectionError("refused"))
+        start = time.monotonic()
+        with pytest.raises(Timeout):
+            driver.get_binary(URL)
+        assert time.monotonic() - start < 1
+    assert driver.latency.errors >= 1
+
+def test_retry_timeout():
+    driver = WebDriver(budget=5)
+    with responses.RequestsMock() as r:
+        r.add(responses.GET, URL, body=Timeout("read timed out"))
+        r.add(responses.GET, URL, body=b"ok")
+        assert driver.get_binary(URL) == b"ok"
+    assert driver.latency.errors == 1
+    assert driver.latency.count == 2 # the timed out attempt is in the histogram too
+
+def test_hedge():
+    calls = list()
+    def answer(request):
+        calls.append(request.url)
+        if len(calls) == 1:
+            time.sleep(1) # stalled first attempt
+        return (200, {}, f"attempt {len(calls)}")
+    driver = WebDriver(hedge=True, hedge_after=0.05)
+    with responses.RequestsMock() as r:
+        r.add_callback(responses.GET, URL, callback=answer)
+        start = time.monotonic()
+        assert driver.get_text(URL) == "attempt 2"
+        assert time.monotonic() - start < 0.5
+    assert driver.latency.hedged == 1
+    driver.quit()
+
+def test_hedge_queued():
+    driver = WebDriver(hedge=True, hedge_after=0.05)
+    driver._hedges = ThreadPoolExecutor(1)
+    busy = driver._hedges.submit(time.sleep, 0.3) # every hedge thread is taken
+    with responses.RequestsMock() as r:
+        r.add(responses.GET, URL, body=b"ok")
+        assert driver.get_binary(URL) == b"ok"
+    assert busy.done()
+    assert driver.latency.hedged == 0
+    driver.quit()
+
+def test_hedge_after_p95():
+    driver = WebDriver(hedge=True)
+    assert driver.hedge_delay() is None # not enough samples yet
+    for _ in range(20):
+        driver.latency.add(0.010)
+    assert driver.hedge_delay() == 0.016